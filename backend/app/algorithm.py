@@ -1,60 +1,834 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import (
+    breadth_first_order, connected_components, maximum_flow, min_weight_full_bipartite_matching,
+)
 
-def solve_assignment(students: List[Dict], options: List[Dict]):
+# Cost of an option the student did not rank
+UNRANKED_COST = 1000
+# Cost of leaving a student without a seat (only possible when seats run out)
+UNASSIGNED_COST = UNRANKED_COST + 1
+
+# Above this many dense matrix cells (students x seats) the slot-expanded
+# Hungarian solve gets too slow and too large, so "auto" switches to a sparse solver
+DENSE_CELL_LIMIT = 1_000_000
+# Beyond the dense limit the sparse matching is used while it has at most this many
+# ranked (student, seat) edges per students x (options + 1) cell of the flow solver.
+# benchmarks.bench_solver puts the sparse solve at about 0.1-2 us per edge and the flow
+# solve at about 0.1-4 us per cell, both growing with how contested the seats are. On
+# the same 20000 x 500 cohort the sparse solve won at 0.4 edges per cell and lost at 0.7
+SPARSE_EDGES_PER_FLOW_CELL = 0.6
+# The sparse matching peaks at about 60 bytes per edge; above this it is never used
+SPARSE_EDGE_LIMIT = 10_000_000
+
+BACKENDS = ("auto", "hungarian", "sparse", "flow")
+# sum: lowest sum of ranks. rank_maximal: most first choices, then most second choices,
+# and so on. min_worst_rank: lowest worst rank any student gets, then lowest sum
+OBJECTIVES = ("sum", "rank_maximal", "min_worst_rank")
+
+# Incremental repair is used while at most 1 in this many students changed;
+# beyond that a full solve is cheaper than one augmenting path per change
+INCREMENTAL_CHANGE_DIVISOR = 10
+
+# States the open/close search of options with minimums may explore at least (or as
+# many as the greedy pass settled, if more) before it keeps the best assignment found
+BOUNDED_SEARCH_NODES = 32
+
+_INF = np.int64(1) << 62
+
+
+def solve_assignment(students: List[Dict], options: List[Dict], backend: str = "auto", objective: str = "sum"):
     """
     students: list of dicts {id: int, preferences: {option_id: rank}}
-    options: list of dicts {id: int, capacity: int}
-    
+    options: list of dicts {id: int, capacity: int, min_capacity: int (optional)}
+    backend: "hungarian", "sparse", "flow" or "auto" (pick based on problem size)
+    objective: one of OBJECTIVES
+
+    An option with a capacity of 0 gets no students. An option with a min_capacity is
+    either left empty or given at least that many students (see _solve_flow_bounded);
+    if its capacity is below that minimum, it gets no students.
+
     Returns: dict {student_id: assigned_option_id}
     """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown solver backend: {backend}")
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective: {objective}")
+
     if not students or not options:
         return {}
-        
-    # Expand options into slots based on capacity
-    # slots maps column_index -> option_id
-    slots = []
-    for opt in options:
-        cap = opt.get('capacity', 1)
-        # Ensure capacity is at least 1 or handle 0
-        cap = max(1, cap)
-        for _ in range(cap):
-            slots.append(opt['id'])
-            
-    num_students = len(students)
-    num_slots = len(slots)
-    
-    if num_slots == 0:
-        return {}
 
-    # Cost matrix: Rows = Students, Cols = Slots
-    # Initialize with high cost (1000)
-    cost_matrix = np.full((num_students, num_slots), 1000)
-    
-    # Pre-calculate slot indices for each option
-    option_to_cols = {}
-    for col_idx, opt_id in enumerate(slots):
-        if opt_id not in option_to_cols:
-            option_to_cols[opt_id] = []
-        option_to_cols[opt_id].append(col_idx)
-        
-    # Fill cost matrix
+    student_idx, option_idx, rank = preferences_to_arrays(students, options)
+    capacities, minimums = option_bounds(options)
+    assigned = solve_assignment_arrays(len(students), capacities, student_idx, option_idx, rank, backend, minimums, objective)
+    return _assignments_from(students, options, assigned)
+
+
+def option_bounds(options: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """(capacities, minimums) of the options; a missing or None minimum is 0."""
+    capacities = np.array([opt.get('capacity', 1) for opt in options], dtype=np.int64)
+    minimums = np.array([opt.get('min_capacity') or 0 for opt in options], dtype=np.int64)
+    return capacities, minimums
+
+
+def preferences_to_arrays(students: List[Dict], options: List[Dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flattens the student dicts into the (student_idx, option_idx, rank) arrays
+    taken by solve_assignment_arrays. Preferences for unknown options are dropped.
+    """
+    option_index = {opt['id']: j for j, opt in enumerate(options)}
+    student_idx = []
+    option_idx = []
+    rank = []
     for i, student in enumerate(students):
-        prefs = student.get('preferences', {})
-        for opt_id, rank in prefs.items():
-            if opt_id in option_to_cols:
-                for col_idx in option_to_cols[opt_id]:
-                    cost_matrix[i, col_idx] = rank
-                    
-    # Solve
+        for opt_id, r in student.get('preferences', {}).items():
+            j = option_index.get(opt_id)
+            if j is not None:
+                student_idx.append(i)
+                option_idx.append(j)
+                rank.append(r)
+    return (
+        np.array(student_idx, dtype=np.int64),
+        np.array(option_idx, dtype=np.int64),
+        np.array(rank, dtype=np.int64),
+    )
+
+
+def solve_assignment_arrays(num_students: int, capacities: np.ndarray, student_idx: np.ndarray,
+                            option_idx: np.ndarray, rank: np.ndarray, backend: str = "auto",
+                            minimums: np.ndarray = None, objective: str = "sum") -> np.ndarray:
+    """
+    Array form of solve_assignment. Preferences are flat arrays where entry k says
+    that student student_idx[k] ranked option option_idx[k] as rank[k].
+    Minimum capacities can only be expressed as flow bounds, so any minimum above 0
+    selects the flow solver whatever the backend; they only work with the sum objective.
+    The rank_maximal objective has its own solver and ignores the backend.
+
+    Returns: array with the assigned option index per student (-1 if unassigned)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown solver backend: {backend}")
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective: {objective}")
+
+    if num_students == 0 or len(capacities) == 0:
+        return np.full(num_students, -1, dtype=np.int64)
+
+    # A capacity of 0 closes the option
+    capacities = np.maximum(np.asarray(capacities, dtype=np.int64), 0)
+    student_idx = np.asarray(student_idx, dtype=np.int64)
+    option_idx = np.asarray(option_idx, dtype=np.int64)
+    rank = np.asarray(rank, dtype=np.int64)
+
+    if minimums is not None and np.any(np.asarray(minimums) > 0):
+        if objective != "sum":
+            raise ValueError("Minimum capacities are only supported by the sum objective")
+        minimums = np.maximum(np.asarray(minimums, dtype=np.int64), 0)
+        # An option that cannot reach its minimum does not run
+        capacities = np.where(minimums > capacities, 0, capacities)
+        minimums = np.minimum(minimums, capacities)
+        return _solve_flow_bounded(num_students, capacities, minimums, student_idx, option_idx, rank)
+
+    if objective == "rank_maximal":
+        return _solve_rank_maximal(num_students, capacities, student_idx, option_idx, rank)
+
+    unranked_cost = UNRANKED_COST
+    if objective == "min_worst_rank":
+        worst = _worst_rank_needed(num_students, capacities, student_idx, option_idx, rank)
+        if worst is not None:
+            # Drop the ranks above the bound and price unranked seats above any assignment
+            # within it, then the usual sum solve breaks the ties. "auto" then picks the
+            # backend for this smaller edge set, which usually favours the sparse solve
+            keep = rank <= worst
+            student_idx, option_idx, rank = student_idx[keep], option_idx[keep], rank[keep]
+            unranked_cost = num_students * worst + 1
+
+    if backend == "auto":
+        backend = select_backend(num_students, capacities, capacities[option_idx])
+
+    if backend == "flow":
+        return _solve_flow(num_students, capacities, student_idx, option_idx, rank, unranked_cost)
+    if backend == "sparse":
+        return _solve_sparse(num_students, capacities, student_idx, option_idx, rank, unranked_cost)
+    return _solve_hungarian(num_students, capacities, student_idx, option_idx, rank, unranked_cost)
+
+
+def select_backend(num_students: int, capacities, ranked_capacities=None) -> str:
+    """
+    Picks the solver for a problem of the given size. The Hungarian solve works on
+    a students x seats matrix, so it is only used while that matrix stays small.
+    The sparse solve keeps one edge per ranked seat (ranked_capacities holds the
+    capacity of the option behind every submitted preference) and the flow solve one
+    cell per student and option, so the smaller of the two, within the memory limit
+    of the sparse solve, decides.
+    """
+    capacities = np.maximum(np.asarray(capacities, dtype=np.int64), 0)
+    num_slots = int(capacities.sum())
+    if num_students * num_slots <= DENSE_CELL_LIMIT:
+        return "hungarian"
+    if ranked_capacities is not None:
+        ranked_capacities = np.asarray(ranked_capacities, dtype=np.int64)
+        num_edges = int(np.clip(ranked_capacities, 0, num_students).sum()) + num_students
+        num_cells = num_students * (len(capacities) + 1)
+        if num_edges <= min(SPARSE_EDGES_PER_FLOW_CELL * num_cells, SPARSE_EDGE_LIMIT):
+            return "sparse"
+    return "flow"
+
+
+def cost_dtype(rank: np.ndarray, fill: int = UNASSIGNED_COST) -> np.dtype:
+    """Smallest integer dtype that holds every rank and the fill cost."""
+    top = max(int(rank.max()) if rank.size else 0, fill)
+    bottom = min(int(rank.min()) if rank.size else 0, 0)
+    return np.promote_types(np.min_scalar_type(top), np.min_scalar_type(bottom))
+
+
+def build_cost_matrix(num_students: int, capacities: np.ndarray, student_idx: np.ndarray,
+                      option_idx: np.ndarray, rank: np.ndarray,
+                      unranked_cost: int = UNRANKED_COST) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the slot-expanded students x seats cost matrix used by the Hungarian solve.
+    The ranks are scattered into a compact students x options matrix in one fancy-indexed
+    write, which is then broadcast to every seat of each option in one gather.
+
+    Returns: (cost_matrix, slot_option) where slot_option maps column -> option index
+    """
+    dtype = cost_dtype(rank, unranked_cost)
+    compact = np.full((num_students, len(capacities)), unranked_cost, dtype=dtype)
+    compact[student_idx, option_idx] = rank
+    slot_option = np.repeat(np.arange(len(capacities)), capacities)
+    return compact[:, slot_option], slot_option
+
+
+def _solve_hungarian(num_students, capacities, student_idx, option_idx, rank, unranked_cost=UNRANKED_COST):
+    cost_matrix, slot_option = build_cost_matrix(num_students, capacities, student_idx, option_idx, rank, unranked_cost)
+
     row_ind, col_ind = linear_sum_assignment(cost_matrix)
-    
+
+    assigned = np.full(num_students, -1, dtype=np.int64)
+    assigned[row_ind] = slot_option[col_ind]
+    return assigned
+
+
+def _solve_sparse(num_students, capacities, student_idx, option_idx, rank, unranked_cost=UNRANKED_COST):
+    # No option ever needs more seats than there are students
+    capacity = np.minimum(capacities, num_students)
+    slot_offset = np.concatenate(([0], np.cumsum(capacity)))
+    num_slots = int(slot_offset[-1])
+
+    # Expand every preference into one edge per seat of the ranked option
+    seats = capacity[option_idx]
+    rows = np.repeat(student_idx, seats)
+    first_seat = np.repeat(slot_offset[option_idx] - np.cumsum(seats) + seats, seats)
+    cols = first_seat + np.arange(rows.size)
+    weights = np.repeat(rank, seats)
+
+    # One fallback column per student keeps a full matching possible; a fallback
+    # student is later given any seat that is left, which costs unranked_cost either way
+    fallback = np.arange(num_students, dtype=np.int64)
+    rows = np.concatenate((rows, fallback))
+    cols = np.concatenate((cols, num_slots + fallback))
+    weights = np.concatenate((weights, np.full(num_students, unranked_cost, dtype=np.int64)))
+
+    # Shift weights so the lowest is 1: scipy drops edges of weight zero. Every row is
+    # matched once, so the optimum is unchanged
+    weights = weights - weights.min() + 1
+    graph = csr_matrix((weights, (rows, cols)), shape=(num_students, num_slots + num_students))
+    _, matched_cols = min_weight_full_bipartite_matching(graph)
+
+    slot_option = np.repeat(np.arange(len(capacity)), capacity)
+    seated = matched_cols < num_slots
+    assigned = np.full(num_students, -1, dtype=np.int64)
+    assigned[seated] = slot_option[matched_cols[seated]]
+
+    # Hand the leftover seats to the fallback students
+    free = capacity - np.bincount(assigned[seated], minlength=len(capacity))
+    leftover = np.repeat(np.arange(len(capacity)), free)
+    unseated = np.flatnonzero(~seated)[:leftover.size]
+    assigned[unseated] = leftover[:unseated.size]
+    return assigned
+
+
+def _flow_cost(num_students, num_options, student_idx, option_idx, rank, unranked_cost=UNRANKED_COST):
+    # Compact cost matrix: Rows = Students, Cols = Options + one overflow column
+    # The overflow column stands for "no seat" and can hold every student
+    cost = np.full((num_students, num_options + 1), unranked_cost, dtype=np.int64)
+    cost[:, num_options] = unranked_cost + 1
+    cost[student_idx, option_idx] = rank
+    return cost
+
+
+def _solve_flow(num_students, capacities, student_idx, option_idx, rank, unranked_cost=UNRANKED_COST):
+    num_options = len(capacities)
+    cost = _flow_cost(num_students, num_options, student_idx, option_idx, rank, unranked_cost)
+    capacity = np.append(capacities, num_students)
+
+    solver = _TransportSolver(cost, capacity)
+    for i in range(num_students):
+        solver.augment(i)
+
+    assigned = solver.assigned.copy()
+    assigned[assigned == num_options] = -1
+    return assigned
+
+
+def _solve_flow_bounded(num_students, capacities, minimums, student_idx, option_idx, rank):
+    """
+    Flow solve where every option is either closed (no students) or holds between its
+    minimum and its capacity. The optimal assignment without minimums is the root of a
+    branch and bound over the options left under their minimum. Each such option is
+    settled in one of two ways:
+    - close: its capacity drops to 0 and its students are seated again along shortest
+      augmenting paths
+    - fill: students are pulled in along the cheapest chains of moves that free a seat
+      elsewhere, then its lower bound is locked so nobody is pulled out again
+    Both keep the assignment optimal for the constraints added so far, so the cost of a
+    state bounds the cost of everything below it, and a state with no option under its
+    minimum is the best one below it.
+    A greedy pass gives the first incumbent: it settles one option per round, the one
+    whose cheaper settle raises the total cost least. Increases from earlier rounds are
+    reused and only recomputed for the option that comes out on top. The search then
+    explores states cheapest settle first and skips any state that cannot beat the
+    incumbent. It settles at most as many states as the greedy pass did (and at least
+    BOUNDED_SEARCH_NODES), which bounds it to about the time of the greedy pass. When
+    it finishes within that limit the result is optimal; otherwise it is the best
+    assignment found.
+    """
+    num_options = len(capacities)
+    cost = _flow_cost(num_students, num_options, student_idx, option_idx, rank)
+    rows = np.arange(num_students)
+    root = _TransportSolver(cost, np.append(capacities, num_students))
+    for i in range(num_students):
+        root.augment(i)
+
+    def total(state):
+        return int(cost[rows, state.assigned].sum())
+
+    def under(state):
+        load = state.count[:num_options]
+        return np.flatnonzero((load > 0) & (load < minimums)).tolist()
+
+    def settle(state, o):
+        """The states with option o filled and closed, as (total cost, state), cheapest first."""
+        found = []
+        filled = state.copy()
+        if all(filled.pull(o) for _ in range(minimums[o] - state.count[o])):
+            filled.locked[o] = True
+            found.append((total(filled), filled))
+        closed = state.copy()
+        for i in closed.close([o]):
+            closed.augment(i)
+        found.append((total(closed), closed))
+        return sorted(found, key=lambda option: option[0]) # Stable: filling wins ties
+
+    solver = root
+    increases = {}
+    settled = 0
+    while True:
+        pending = under(solver)
+        if not pending:
+            break
+        current = total(solver)
+        for o in pending:
+            if o not in increases:
+                increases[o] = settle(solver, o)[0][0] - current
+                settled += 1
+        while True:
+            o = min(increases, key=increases.get)
+            best_total, candidate = settle(solver, o)[0]
+            settled += 1
+            increases[o] = best_total - current
+            if increases[o] <= min(increases.values()):
+                break
+        solver = candidate
+        del increases[o]
+
+    best, best_total = solver, total(solver)
+    stack = [(total(root), root)]
+    nodes = 0
+    while stack and nodes < max(settled, BOUNDED_SEARCH_NODES):
+        state_total, state = stack.pop()
+        if state_total >= best_total:
+            continue
+        pending = under(state)
+        if not pending:
+            best, best_total = state, state_total
+            continue
+        nodes += 1
+        # Pushed in reverse, so the cheaper settle is explored first
+        stack += [child for child in reversed(settle(state, pending[0])) if child[0] < best_total]
+
+    assigned = best.assigned.copy()
+    assigned[assigned == num_options] = -1
+    return assigned
+
+
+def _residual_graph(num_students, capacities, assigned, student_idx, option_idx,
+                    fallback_students=None, fallback_options=None, reverse=False) -> csr_matrix:
+    """
+    Residual graph of an assignment over the edges (student_idx, option_idx). Nodes
+    are the students, then the options, then an "any option" node, the source and the
+    sink. Unused edges point from student to option and used ones back; the source
+    reaches every unseated student and options with free seats reach the sink.
+    fallback_students and fallback_options mark who may take and which options may
+    give an unranked seat, through the "any option" node. With reverse=True the arcs back into the source (from seated
+    students) and out of the sink (to options holding students) are added, which an
+    augmenting path never takes but reachability needs.
+    """
+    num_options = len(capacities)
+    any_node = num_students + num_options
+    source, sink = any_node + 1, any_node + 2
+    students = np.arange(num_students)
+    options = np.arange(num_options)
+    load = np.bincount(assigned[assigned >= 0], minlength=num_options)
+    used = assigned[student_idx] == option_idx
+    seated = assigned >= 0
+    free = capacities - load
+
+    tails = [np.where(used, num_students + option_idx, student_idx), np.full((~seated).sum(), source), num_students + options[free > 0]]
+    heads = [np.where(used, student_idx, num_students + option_idx), students[~seated], np.full((free > 0).sum(), sink)]
+    caps = [np.ones(student_idx.size), np.ones((~seated).sum()), free[free > 0]]
+    if fallback_students is not None:
+        tails += [students[fallback_students], np.full(fallback_options.sum(), any_node)]
+        heads += [np.full(fallback_students.sum(), any_node), num_students + options[fallback_options]]
+        caps += [np.ones(fallback_students.sum()), capacities[fallback_options]]
+    if reverse:
+        tails += [students[seated], np.full((load > 0).sum(), sink)]
+        heads += [np.full(seated.sum(), source), num_students + options[load > 0]]
+        caps += [np.ones(seated.sum()), load[load > 0]]
+    num_nodes = sink + 1
+    return csr_matrix(
+        (np.concatenate(caps).astype(np.int32), (np.concatenate(tails), np.concatenate(heads))),
+        shape=(num_nodes, num_nodes),
+    )
+
+
+def _augment(num_students, capacities, assigned, graph) -> np.ndarray:
+    """
+    Extends the assignment by a maximum flow through its residual graph. The flow
+    only follows augmenting paths, so seated students stay seated and full options
+    stay full. Students routed through the "any option" node get the seats it sends
+    on, in option order.
+    """
+    num_options = len(capacities)
+    any_node = num_students + num_options
+    flow = maximum_flow(graph, any_node + 1, any_node + 2).flow.tocoo()
+    positive = flow.data > 0
+    tails, heads, units = flow.row[positive], flow.col[positive], flow.data[positive]
+
+    assigned = assigned.copy()
+    moved = (tails < num_students) & (heads >= num_students) & (heads < any_node)
+    assigned[tails[moved]] = heads[moved] - num_students
+    unranked = tails[(tails < num_students) & (heads == any_node)]
+    from_any = tails == any_node
+    assigned[unranked] = np.repeat(heads[from_any] - num_students, units[from_any])
+    return assigned
+
+
+def _solve_rank_maximal(num_students, capacities, student_idx, option_idx, rank):
+    """
+    Rank-maximal assignment: as many first choices as possible, then as many second
+    choices as that allows, and so on, with unranked seats as the last level. This is
+    the rank-maximal matching algorithm of Irving et al. with options as vertices that
+    hold several students. It runs one maximum-flow phase per rank level:
+    - augment: the edges up to this rank extend the assignment along augmenting paths
+    - reduce: in the residual graph, seated students the source cannot reach and full
+      options that cannot reach the sink keep their rank in every maximum assignment,
+      so their edges of later ranks are dropped. Unused edges whose ends lie in
+      different strongly connected components are in no maximum assignment and are
+      dropped too.
+    Capacities are the only numbers involved, so any number of ranks works without
+    exponential weights.
+    """
+    num_options = len(capacities)
+    any_node = num_students + num_options
+    source, sink = any_node + 1, any_node + 2
+    assigned = np.full(num_students, -1, dtype=np.int64)
+    alive = np.ones(rank.size, dtype=bool)
+    settled_students = np.zeros(num_students, dtype=bool)
+    settled_options = np.zeros(num_options, dtype=bool)
+
+    for level in np.unique(rank):
+        active = np.flatnonzero(alive & (rank <= level))
+        s, o = student_idx[active], option_idx[active]
+        assigned = _augment(num_students, capacities, assigned, _residual_graph(num_students, capacities, assigned, s, o))
+
+        graph = _residual_graph(num_students, capacities, assigned, s, o, reverse=True)
+        from_source = np.zeros(graph.shape[0], dtype=bool)
+        from_source[breadth_first_order(graph, source, return_predecessors=False)] = True
+        to_sink = np.zeros(graph.shape[0], dtype=bool)
+        to_sink[breadth_first_order(graph.T.tocsr(), sink, return_predecessors=False)] = True
+        load = np.bincount(assigned[assigned >= 0], minlength=num_options)
+        settled_students |= (assigned >= 0) & ~from_source[:num_students]
+        settled_options |= (load >= capacities) & ~to_sink[num_students:any_node]
+
+        _, component = connected_components(graph, directed=True, connection="strong")
+        unusable = (assigned[s] != o) & (component[s] != component[num_students + o])
+        alive[active[unusable]] = False
+        alive &= ~((rank > level) & (settled_students[student_idx] | settled_options[option_idx]))
+
+    # Unranked seats, between students and options that are not settled
+    graph = _residual_graph(num_students, capacities, assigned, student_idx[alive], option_idx[alive],
+                            fallback_students=~settled_students, fallback_options=~settled_options)
+    return _augment(num_students, capacities, assigned, graph)
+
+
+def _worst_rank_needed(num_students, capacities, student_idx, option_idx, rank):
+    """
+    Lowest rank r such that students can fill min(students, seats) seats using only
+    options they ranked r or better, or None when that takes unranked seats too.
+    Binary search over the ranks, with one maximum flow per probe.
+    """
+    target = min(num_students, int(capacities.sum()))
+    levels = np.unique(rank)
+    nobody = np.full(num_students, -1, dtype=np.int64)
+
+    def fills_target(level):
+        keep = rank <= level
+        graph = _residual_graph(num_students, capacities, nobody, student_idx[keep], option_idx[keep])
+        any_node = num_students + len(capacities)
+        return maximum_flow(graph, any_node + 1, any_node + 2).flow_value >= target
+
+    if levels.size == 0 or not fills_target(levels[-1]):
+        return None
+    low, high = 0, levels.size - 1
+    while low < high:
+        middle = (low + high) // 2
+        if fills_target(levels[middle]):
+            high = middle
+        else:
+            low = middle + 1
+    return int(levels[low])
+
+
+def solve_assignment_incremental(students: List[Dict], options: List[Dict], previous: Dict = None,
+                                 backend: str = "auto", objective: str = "sum"):
+    """
+    Like solve_assignment, but reuses the optimal assignment of an earlier run.
+    Students whose preferences did not change keep their seat and the flow solver
+    only repairs the assignment for the students that were added, edited or removed,
+    giving the same total cost as a full re-solve. Falls back to a full solve with
+    the given backend and objective when there is no usable previous state, too much
+    changed or the objective is not the sum of ranks.
+
+    previous: state returned by an earlier call for the same project (or None)
+
+    Returns: (dict {student_id: assigned_option_id}, state for the next call)
+    """
+    option_ids = [opt['id'] for opt in options]
+    capacities, minimums = option_bounds(options)
+    capacities = np.maximum(capacities, 0)
+    # Preferences are ints only, so these hashes are stable across worker processes
+    fingerprints = [hash(tuple(sorted(s.get('preferences', {}).items()))) for s in students]
+    student_ids = [s['id'] for s in students]
+
+    state = {
+        "option_ids": option_ids,
+        "capacities": capacities,
+        "minimums": minimums,
+        "objective": objective,
+        "student_ids": student_ids,
+        "fingerprints": fingerprints,
+        "assigned": None,
+        "potential": None,
+    }
+
+    if not students or not options:
+        state["assigned"] = np.full(len(students), -1, dtype=np.int64)
+        return {}, state
+
+    student_idx, option_idx, rank = preferences_to_arrays(students, options)
+    num_options = len(options)
+
+    # Solves with minimums close options along the way, which a repair cannot redo;
+    # the repair itself minimises the sum of ranks only
+    repairable = (
+        previous is not None
+        and objective == previous.get("objective", "sum") == "sum"
+        and previous["option_ids"] == option_ids
+        and np.array_equal(previous["capacities"], capacities)
+        and not minimums.any()
+        and not np.any(previous.get("minimums", 0))
+    )
+    if repairable:
+        before = dict(zip(previous["student_ids"], zip(previous["fingerprints"], previous["assigned"])))
+        kept = [i for i, (sid, fp) in enumerate(zip(student_ids, fingerprints))
+                if sid in before and before[sid][0] == fp]
+        kept_ids = {student_ids[i] for i in kept}
+        removed = [sid for sid in previous["student_ids"] if sid not in kept_ids]
+        added = [i for i in range(len(students)) if student_ids[i] not in kept_ids]
+        repairable = (len(removed) + len(added)) * INCREMENTAL_CHANGE_DIVISOR <= len(students)
+
+    if not repairable:
+        assigned = solve_assignment_arrays(len(students), capacities, student_idx, option_idx, rank, backend, minimums, objective)
+        state["assigned"] = assigned
+        return _assignments_from(students, options, assigned), state
+
+    # Rows: current students first, then one placeholder row per removed student
+    # that only holds its old seat until it is taken out
+    num_rows = len(students) + len(removed)
+    cost = _flow_cost(num_rows, num_options, student_idx, option_idx, rank)
+    capacity = np.append(capacities, num_rows)
+
+    # Previously unseated students sit in the overflow column
+    def previous_seat(sid):
+        j = before[sid][1]
+        return j if j >= 0 else num_options
+
+    assigned = np.full(num_rows, -1, dtype=np.int64)
+    movable = np.zeros(num_rows, dtype=bool)
+    for i in kept:
+        assigned[i] = previous_seat(student_ids[i])
+        movable[i] = True
+    for k, sid in enumerate(removed):
+        assigned[len(students) + k] = previous_seat(sid)
+
+    solver = _TransportSolver(cost, capacity)
+    solver.seat(assigned, movable, previous["potential"])
+    for k in range(len(removed)):
+        solver.remove(len(students) + k)
+    for i in added:
+        solver.augment(i)
+
+    assigned = solver.assigned[:len(students)].copy()
+    assigned[assigned == num_options] = -1
+    state["assigned"] = assigned
+    state["potential"] = solver.potential.copy()
+    return _assignments_from(students, options, assigned), state
+
+
+def _assignments_from(students, options, assigned):
     assignments = {}
-    for r, c in zip(row_ind, col_ind):
-        if r < len(students) and c < len(slots):
-            student_id = students[r]['id']
-            option_id = slots[c]
-            assignments[student_id] = option_id
-            
+    for i in np.flatnonzero(assigned >= 0):
+        assignments[students[i]['id']] = options[assigned[i]]['id']
     return assignments
+
+
+class _TransportSolver:
+    """
+    Min-cost flow for the transportation problem students -> options, solved with
+    successive shortest paths. Students are never expanded into nodes: the
+    Dijkstra runs over option nodes only, where the arc o -> p is the cheapest way
+    of moving one student currently seated in o over to p. Node potentials keep
+    all reduced arc costs non-negative between augmentations.
+    """
+
+    def __init__(self, cost: np.ndarray, capacity: np.ndarray):
+        self.cost = cost
+        self.capacity = capacity
+        num_students, num_options = cost.shape
+        self.sink = num_options
+        self.assigned = np.full(num_students, -1, dtype=np.int64)
+        self.count = np.zeros(num_options, dtype=np.int64)
+        self.members = [set() for _ in range(num_options)]
+        # One potential per option, plus one for the sink
+        self.potential = np.zeros(num_options + 1, dtype=np.int64)
+        self.move_cost = np.full((num_options, num_options), _INF, dtype=np.int64)
+        self.move_student = np.full((num_options, num_options), -1, dtype=np.int64)
+        # Options that keep their students: nobody is taken out of them by remove or pull
+        self.locked = np.zeros(num_options, dtype=bool)
+
+    def copy(self) -> "_TransportSolver":
+        """Independent copy of the state; the cost matrix is shared, it is never written."""
+        other = object.__new__(_TransportSolver)
+        other.__dict__.update({
+            key: value.copy() if isinstance(value, np.ndarray) and key != "cost" else value
+            for key, value in self.__dict__.items()
+        })
+        other.members = [set(m) for m in self.members]
+        return other
+
+    def augment(self, i: int):
+        """Seats student i, shifting other students along a shortest path if needed."""
+        num_options = self.sink
+        potential = self.potential
+        dist = self.cost[i] - potential[:num_options]
+        prev = np.full(num_options, -1, dtype=np.int64)
+        done = np.zeros(num_options, dtype=bool)
+        sink_dist = _INF
+        sink_from = -1
+
+        while True:
+            remaining = np.where(done, _INF, dist)
+            o = int(remaining.argmin())
+            d = remaining[o]
+            if d >= sink_dist:
+                break
+            done[o] = True
+            if self.count[o] < self.capacity[o]:
+                reduced = d + potential[o] - potential[self.sink]
+                if reduced < sink_dist:
+                    sink_dist = reduced
+                    sink_from = o
+            arcs = self.move_cost[o]
+            cand = d + arcs + potential[o] - potential[:num_options]
+            better = (arcs < _INF) & ~done & (cand < dist)
+            dist[better] = cand[better]
+            prev[better] = o
+
+        # Collect the moves along the path before touching any membership
+        path = [sink_from]
+        while prev[path[-1]] >= 0:
+            path.append(int(prev[path[-1]]))
+        path.reverse()
+        moves = [(i, -1, path[0])]
+        for a, b in zip(path, path[1:]):
+            moves.append((int(self.move_student[a, b]), a, b))
+
+        for student, src, dst in moves:
+            if src >= 0:
+                self.members[src].discard(student)
+                self.count[src] -= 1
+            self.members[dst].add(student)
+            self.count[dst] += 1
+            self.assigned[student] = dst
+
+        potential[:num_options] += np.minimum(dist, sink_dist)
+        potential[self.sink] += sink_dist
+        for o in path:
+            self._refresh_moves(o)
+
+    def seat(self, assigned: np.ndarray, movable: np.ndarray, potential: np.ndarray = None):
+        """
+        Loads an existing optimal assignment (overflow column for unseated students,
+        -1 for students that still have to be augmented).
+        Students that are not movable only hold their seat and never take part in a
+        path; they are expected to be removed next. Without stored potentials they
+        are recovered from the residual graph.
+        """
+        self.assigned[:] = assigned
+        self.count = np.bincount(assigned[assigned >= 0], minlength=self.sink).astype(np.int64)
+        for i in np.flatnonzero(movable):
+            self.members[assigned[i]].add(int(i))
+        for o in range(self.sink):
+            self._refresh_moves(o)
+        if potential is not None:
+            self.potential[:] = potential
+        else:
+            self.potential[:] = self._shortest_distances()
+
+    def remove(self, i: int):
+        """
+        Takes student i out, cancelling its unit of flow along a shortest path from the
+        sink so that the remaining assignment stays optimal.
+        """
+        target = int(self.assigned[i])
+        sources = (self.count > 0) & ~self.locked
+        sources[target] = True # The seat of i itself is always free to give up
+        dist, path = self._path_from_sink(target, sources)
+        self._shift(path)
+        self.members[target].discard(i)
+        self.count[target] -= 1
+        self.assigned[i] = -1
+        self._settle(dist, path)
+
+    def pull(self, target: int) -> bool:
+        """
+        Seats one more student in target by the cheapest chain of moves that ends with
+        a student leaving an option that is not locked. Returns False when there is none.
+        """
+        sources = (self.count > 0) & ~self.locked
+        sources[target] = False
+        found = self._path_from_sink(target, sources)
+        if found is None:
+            return False
+        dist, path = found
+        self._shift(path)
+        self._settle(dist, path)
+        return True
+
+    def _path_from_sink(self, target: int, sources: np.ndarray):
+        """
+        Dijkstra from the sink back to target. The sink reaches each option in sources,
+        where one student can give up a seat, and options reach each other through the
+        move arcs. Returns (dist, path of options ending in target), or None.
+        """
+        num_options = self.sink
+        potential = self.potential
+        dist = np.where(sources, potential[self.sink] - potential[:num_options], _INF)
+        prev = np.full(num_options, -1, dtype=np.int64)
+        done = np.zeros(num_options, dtype=bool)
+
+        while True:
+            remaining = np.where(done, _INF, dist)
+            o = int(remaining.argmin())
+            d = remaining[o]
+            if d >= _INF:
+                return None
+            done[o] = True
+            if o == target:
+                break
+            arcs = self.move_cost[o]
+            cand = d + arcs + potential[o] - potential[:num_options]
+            better = (arcs < _INF) & ~done & (cand < dist)
+            dist[better] = cand[better]
+            prev[better] = o
+
+        path = [target]
+        while prev[path[-1]] >= 0:
+            path.append(int(prev[path[-1]]))
+        path.reverse()
+        return dist, path
+
+    def _shift(self, path: List[int]):
+        """Moves one student along each arc of the path: the first option loses one, the last gains one."""
+        moves = [(int(self.move_student[a, b]), a, b) for a, b in zip(path, path[1:])]
+        for student, src, dst in moves:
+            self.members[src].discard(student)
+            self.count[src] -= 1
+            self.members[dst].add(student)
+            self.count[dst] += 1
+            self.assigned[student] = dst
+
+    def _settle(self, dist: np.ndarray, path: List[int]):
+        self.potential[:self.sink] += np.minimum(dist, dist[path[-1]])
+        for o in path:
+            self._refresh_moves(o)
+
+    def close(self, options: List[int]) -> np.ndarray:
+        """
+        Sets the capacity of the options to 0 and unseats their students, who are
+        returned for augmenting again. Every arc left in the residual graph was there
+        before with the same cost, so the rest of the assignment stays optimal and the
+        potentials stay valid.
+        """
+        evicted = np.flatnonzero(np.isin(self.assigned, options))
+        for i in evicted:
+            self.members[self.assigned[i]].discard(int(i))
+        self.assigned[evicted] = -1
+        self.count[options] = 0
+        self.capacity[options] = 0
+        for o in options:
+            self._refresh_moves(int(o))
+        return evicted
+
+    def _shortest_distances(self) -> np.ndarray:
+        # Bellman-Ford over options + sink from a virtual root; an optimal
+        # assignment has no negative cycle, so this settles within n rounds
+        n = self.sink + 1
+        arcs = np.full((n, n), _INF, dtype=np.int64)
+        arcs[:self.sink, :self.sink] = self.move_cost
+        arcs[:self.sink, self.sink] = np.where(self.count < self.capacity, 0, _INF)
+        arcs[self.sink, :self.sink] = np.where(self.count > 0, 0, _INF)
+        dist = np.zeros(n, dtype=np.int64)
+        for _ in range(n + 1):
+            cand = np.minimum(dist, (dist[:, None] + arcs).min(axis=0))
+            if np.array_equal(cand, dist):
+                return dist
+            dist = cand
+        raise ValueError("Previous assignment is not optimal")
+
+    def _refresh_moves(self, o: int):
+        if not self.members[o]:
+            self.move_cost[o] = _INF
+            self.move_student[o] = -1
+            return
+        idx = np.fromiter(self.members[o], dtype=np.int64, count=len(self.members[o]))
+        delta = self.cost[idx] - self.cost[idx, o][:, None]
+        best = delta.argmin(axis=0)
+        cols = np.arange(delta.shape[1])
+        self.move_cost[o] = delta[best, cols]
+        self.move_student[o] = idx[best]
+        self.move_cost[o, o] = _INF
+        self.move_student[o, o] = -1
@@ -1,28 +1,22 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Deque, Dict, NamedTuple, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from . import models, database
-from pydantic_settings import BaseSettings
+from .cache import TTLCache
+from .config import Settings, settings
 import os
 
-class Settings(BaseSettings):
-    SECRET_KEY: str
-    ALGORITHM: str = "HS256"
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
-    REGISTER_SECRET: str
-    DOMAIN: str = "localhost" # For cookie domain setting
-    ENVIRONMENT: str = "development" # development or production
-
-    class Config:
-        env_file = ".env"
-
-settings = Settings()
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with a different cost than BCRYPT_ROUNDS are flagged by verify_and_update and rehashed on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/admin/login", auto_error=False)
 
 PEPPER = os.getenv("PASSWORD_PEPPER")
@@ -41,6 +35,100 @@ def get_password_hash(password):
     pre_hashed = hashlib.sha256((password + PEPPER).encode('utf-8')).hexdigest()
     return pwd_context.hash(pre_hashed)
 
+def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """Like verify_password, also returns a new hash when the stored one uses an outdated cost."""
+    pre_hashed = hashlib.sha256((plain_password + PEPPER).encode('utf-8')).hexdigest()
+    return pwd_context.verify_and_update(pre_hashed, hashed_password)
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool. bcrypt releases the GIL, so the pool
+    caps the CPU spent on hashing while the event loop and the request threadpool keep
+    serving everything else. Once queue_limit operations are waiting or running, new ones
+    are rejected right away with 503 instead of queueing behind a burst of logins.
+    """
+
+    LATENCY_SAMPLES = 1000 # Recent operations kept per kind for the percentiles
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self.rejected = 0
+        self._counts: Dict[str, int] = {}
+        self._wait: Dict[str, Deque[float]] = {}
+        self._duration: Dict[str, Deque[float]] = {}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def submit(self, operation: str, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._outstanding >= self.queue_limit:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many password checks in progress, try again shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self._outstanding += 1
+        return self.executor.submit(self._timed, operation, time.perf_counter(), fn, *args)
+
+    def run(self, operation: str, fn: Callable, *args):
+        """Runs fn on the pool and waits for it, for sync endpoints."""
+        return self.submit(operation, fn, *args).result()
+
+    async def run_async(self, operation: str, fn: Callable, *args):
+        return await asyncio.wrap_future(self.submit(operation, fn, *args))
+
+    def _timed(self, operation: str, queued_at: float, fn: Callable, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._outstanding -= 1
+                self._counts[operation] = self._counts.get(operation, 0) + 1
+                self._wait.setdefault(operation, deque(maxlen=self.LATENCY_SAMPLES)).append(started - queued_at)
+                self._duration.setdefault(operation, deque(maxlen=self.LATENCY_SAMPLES)).append(finished - started)
+
+    def stats(self) -> dict:
+        """Pool usage and latency percentiles (ms) of recent hash and verify operations."""
+        def summary(samples):
+            ordered = sorted(samples)
+            pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+            return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_progress": self._outstanding,
+                "rejected": self.rejected,
+                "rounds": settings.BCRYPT_ROUNDS,
+                "operations": {
+                    operation: {
+                        "count": count,
+                        "duration": summary(self._duration[operation]),
+                        "queue_wait": summary(self._wait[operation]),
+                    }
+                    for operation, count in self._counts.items()
+                },
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -51,9 +139,30 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+def create_admin_token(user: models.Admin):
+    """Session token naming the admin by id, valid while the admin's token_version is unchanged."""
+    return create_access_token(
+        data={"sub": user.email, "uid": user.id, "ver": user.token_version or 0},
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+
+# Current token_version per admin id, so most requests authenticate without SQL
+token_versions = TTLCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
+
+def revoke_tokens(db: Session, user: models.Admin):
+    """Commits pending changes together with a new token_version, invalidating every token issued so far."""
+    user.token_version = (user.token_version or 0) + 1
+    db.commit()
+    token_versions.invalidate(user.id)
+
+class CurrentAdmin(NamedTuple):
+    """The authenticated admin as named by the token. Use get_current_admin for the full row."""
+    id: int
+    email: str
+
 from fastapi import Request
 
-def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> CurrentAdmin:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -75,8 +184,30 @@ def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_sch
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(models.Admin).filter(models.Admin.email == email).first()
-    if user is None:
+
+    user_id = payload.get("uid")
+    if user_id is None:
+        # Token issued before tokens carried the admin id, look the admin up by email
+        user = db.query(models.Admin.id, models.Admin.email).filter(models.Admin.email == email).first()
+        if user is None:
+            raise credentials_exception
+        return CurrentAdmin(id=user.id, email=user.email)
+
+    def load_version():
+        admin = db.query(models.Admin.token_version).filter(models.Admin.id == user_id).first()
+        return None if admin is None else admin.token_version or 0
+
+    if token_versions.get_or_load(user_id, load_version) != payload.get("ver"):
         raise credentials_exception
+    return CurrentAdmin(id=user_id, email=email)
+
+def get_current_admin(current_user: CurrentAdmin = Depends(get_current_user), db: Session = Depends(database.get_db)) -> models.Admin:
+    """The authenticated admin's row, for routes that read or change the account itself."""
+    user = db.get(models.Admin, current_user.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
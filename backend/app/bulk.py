@@ -0,0 +1,179 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import BinaryIO, Dict, List, Sequence, Tuple
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Parquet is optional, CSV works without it
+    pa = pq = None
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from . import models, database, jobs, migrations
+from .exports import EXPORT_BATCH_SIZE
+
+_options = models.Option.__table__
+_students = models.Student.__table__
+_preferences = models.Preference.__table__
+
+FORMATS = ("parquet", "csv")
+DEFAULT_FORMAT = "parquet" if pa is not None else "csv"
+
+# Column name and Arrow type per exported table
+TABLE_COLUMNS = {
+    "options": [("project_id", "int64"), ("option_id", "int64"), ("title", "string"), ("capacity", "int64"), ("min_capacity", "int64")],
+    "students": [("project_id", "int64"), ("student_id", "int64"), ("student_number", "string")],
+    "preferences": [("student_id", "int64"), ("option_id", "int64"), ("rank", "int64")],
+    "assignments": [("student_id", "int64"), ("option_id", "int64")],
+}
+
+IMPORT_COLUMNS = ("student_number", "option_id", "rank")
+
+
+def _table_queries(project_ids: Sequence[int]):
+    in_projects = _students.c.project_id.in_(project_ids)
+    return {
+        "options": select(_options.c.project_id, _options.c.id, _options.c.title, _options.c.capacity, _options.c.min_capacity)
+            .where(_options.c.project_id.in_(project_ids)).order_by(_options.c.id),
+        "students": select(_students.c.project_id, _students.c.id, _students.c.student_number)
+            .where(in_projects).order_by(_students.c.id),
+        "preferences": select(_preferences.c.student_id, _preferences.c.option_id, _preferences.c.rank)
+            .join(_students, _students.c.id == _preferences.c.student_id)
+            .where(in_projects).order_by(_preferences.c.student_id, _preferences.c.rank),
+        "assignments": select(_students.c.id, _students.c.assigned_option_id)
+            .where(in_projects).order_by(_students.c.id),
+    }
+
+
+def export_archive(project_ids: Sequence[int], fmt: str) -> str:
+    """
+    Writes options, students, preferences and assignments of the projects into a zip
+    of Parquet or CSV files and returns its path. Rows come from plain column queries
+    read in batches, so no ORM objects are built and memory stays bounded.
+    The caller removes the file's directory once it has been sent.
+    """
+    directory = tempfile.mkdtemp(prefix="bulk_export_")
+    archive = os.path.join(directory, "export.zip")
+    db = database.SessionLocal()
+    try:
+        queries = _table_queries(project_ids)
+        if fmt == "parquet":
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+                for name, query in queries.items():
+                    path = os.path.join(directory, f"{name}.parquet")
+                    schema = pa.schema([(column, getattr(pa, kind)()) for column, kind in TABLE_COLUMNS[name]])
+                    with pq.ParquetWriter(path, schema) as writer:
+                        result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+                        for rows in result.partitions():
+                            writer.write_batch(pa.record_batch(list(zip(*rows)), schema=schema))
+                    zf.write(path, f"{name}.parquet")
+                    os.remove(path)
+        else:
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+                for name, query in queries.items():
+                    with zf.open(f"{name}.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as text:
+                        writer = csv.writer(text, lineterminator="\n")
+                        writer.writerow([column for column, _ in TABLE_COLUMNS[name]])
+                        result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+                        for rows in result.partitions():
+                            writer.writerows(rows)
+        return archive
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    finally:
+        db.close()
+
+
+def read_preferences(file: BinaryIO, filename: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Reads a preference file with one row per (student_number, option_id, rank), as CSV
+    or Parquet (by extension), into the preferences of each student in file order.
+    Raises ValueError when the file does not have that shape.
+    """
+    if filename.lower().endswith(".parquet"):
+        if pq is None:
+            raise ValueError("Reading Parquet files requires pyarrow, upload a CSV file instead")
+        try:
+            columns = pq.read_table(file, columns=list(IMPORT_COLUMNS)).to_pydict()
+        except (pa.ArrowInvalid, KeyError) as e:
+            raise ValueError(f"Invalid Parquet file: {e}")
+        rows = zip(*(columns[column] for column in IMPORT_COLUMNS))
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+        missing = set(IMPORT_COLUMNS) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+        rows = ((row["student_number"], row["option_id"], row["rank"]) for row in reader)
+
+    preferences: Dict[str, List[Tuple[int, int]]] = {}
+    seen: Dict[Tuple[str, int], int] = {} # (student_number, option_id) -> first row
+    for line, (student_number, option_id, rank) in enumerate(rows, start=1):
+        try:
+            preference = (int(option_id), int(rank))
+        except (TypeError, ValueError):
+            raise ValueError(f"Row {line}: option_id and rank must be integers")
+        if not student_number:
+            raise ValueError(f"Row {line}: student_number is empty")
+        if preference[1] < 1:
+            raise ValueError(f"Row {line}: rank must be 1 or higher")
+        key = (str(student_number), preference[0])
+        if key in seen:
+            raise ValueError(f"Row {line}: student {key[0]} already ranked option {key[1]} in row {seen[key]}")
+        seen[key] = line
+        preferences.setdefault(key[0], []).append(preference)
+    return preferences
+
+
+def import_preferences(db: Session, project_id: int, preferences: Dict[str, List[Tuple[int, int]]]) -> int:
+    """
+    Adds the students and their preferences to the project in one transaction and
+    returns the number of preference rows. Raises ValueError for an empty file, options
+    outside the project, ranks below 1 or options ranked twice, and IntegrityError
+    (after rolling back) when a student already exists. On an old database without the
+    unique student number index, an existing student raises ValueError instead.
+    """
+    # An empty executemany would insert one row of NULLs
+    if not preferences:
+        raise ValueError("The file contains no preferences")
+    for student_number, prefs in preferences.items():
+        if any(rank < 1 for _, rank in prefs):
+            raise ValueError(f"Student {student_number}: ranks must be 1 or higher")
+        if len({option_id for option_id, _ in prefs}) != len(prefs):
+            raise ValueError(f"Student {student_number}: an option is ranked more than once")
+    option_ids = set(db.execute(select(_options.c.id).where(_options.c.project_id == project_id)).scalars())
+    unknown = {option_id for prefs in preferences.values() for option_id, _ in prefs} - option_ids
+    if unknown:
+        raise ValueError(f"Unknown option ids for this project: {', '.join(map(str, sorted(unknown)[:20]))}")
+
+    with database.write_lock(db.get_bind()):
+        if models.STUDENT_NUMBER_INDEX in migrations.skipped_indexes:
+            existing = db.execute(select(_students.c.student_number).where(
+                _students.c.project_id == project_id, _students.c.student_number.in_(list(preferences))
+            )).scalars().first()
+            if existing is not None:
+                db.rollback()
+                raise ValueError(f"Student {existing} has already submitted preferences for this project")
+        try:
+            db.execute(insert(_students), [
+                {"project_id": project_id, "student_number": student_number} for student_number in preferences
+            ])
+            student_ids = dict(db.execute(
+                select(_students.c.student_number, _students.c.id).where(_students.c.project_id == project_id)
+            ).all())
+            rows = [
+                {"student_id": student_ids[student_number], "option_id": option_id, "rank": rank}
+                for student_number, prefs in preferences.items()
+                for option_id, rank in prefs
+            ]
+            if rows:
+                db.execute(insert(_preferences), rows)
+            jobs.bump_revision(db, project_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return len(rows)
@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple, Optional
+from sqlalchemy.orm import Session, selectinload
+from . import models, schemas
+from .config import settings
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl seconds.
+    Values loaded while a key was invalidated are not stored, so an invalidation
+    can never be overwritten by a load that read the old rows.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generation = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_or_load(self, key: Hashable, loader: Callable):
+        """Returns the cached value or loads and caches it. None results are not cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            generation = self._generation
+        value = loader()
+        if value is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+class CachedProject(NamedTuple):
+    id: int
+    title: str
+    is_active: bool
+    is_closed: bool
+    options_json: bytes # Serialized ProjectResponse served by the student options endpoint
+    etag: str
+
+
+projects = TTLCache(settings.PROJECT_CACHE_SIZE, settings.PROJECT_CACHE_TTL_SECONDS)
+
+
+def get_project(db: Session, unique_code: str) -> Optional[CachedProject]:
+    """Project metadata and options payload for the student portal, cached by unique_code."""
+    def load():
+        project = (
+            db.query(models.Project)
+            .options(selectinload(models.Project.options))
+            .filter(models.Project.unique_code == unique_code)
+            .first()
+        )
+        if not project:
+            return None
+        body = schemas.ProjectResponse.model_validate(project).model_dump_json().encode()
+        return CachedProject(
+            id=project.id,
+            title=project.title,
+            is_active=project.is_active,
+            is_closed=project.is_closed,
+            options_json=body,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        )
+    return projects.get_or_load(unique_code, load)
+
+
+def invalidate_project(unique_code: str):
+    """Call after committing a change to a project or its options."""
+    projects.invalidate(unique_code)
@@ -0,0 +1,91 @@
+"""
+Command line tasks against the configured database (it reads the same environment
+variables as the API).
+
+Recalculate the results of many projects at once, e.g. after finalising them all
+at semester start. One read pass loads every project, the solves run in a process
+pool across the CPU cores, and one write pass stores all assignments:
+    python -m app.cli calculate --all
+    python -m app.cli calculate --department Informatics --objective rank_maximal
+    python -m app.cli calculate --admin someone@example.edu --workers 8
+    python -m app.cli calculate --project 3 --project 7 --json
+Without --project only finalised projects that are not archived are included.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import List
+from . import models, database, jobs, algorithm
+from .migrations import run_migrations
+
+
+def select_projects(args) -> List[int]:
+    db = database.SessionLocal()
+    try:
+        query = db.query(models.Project.id)
+        if args.project:
+            query = query.filter(models.Project.id.in_(args.project))
+        else:
+            query = query.filter(models.Project.is_active.is_(True), models.Project.archived.is_(False))
+        if args.admin or args.department:
+            query = query.join(models.Admin, models.Admin.id == models.Project.owner_id)
+            if args.admin:
+                query = query.filter(models.Admin.email == args.admin)
+            else:
+                query = query.filter(models.Admin.department == args.department)
+        return [row[0] for row in query.order_by(models.Project.id)]
+    finally:
+        db.close()
+
+
+async def run_calculate(project_ids: List[int], objective: str, workers: int) -> dict:
+    manager = jobs.JobManager(max_workers=workers)
+    try:
+        return await manager.run_batch(project_ids, objective)
+    finally:
+        manager.shutdown()
+
+
+def calculate(args) -> int:
+    project_ids = select_projects(args)
+    if not project_ids:
+        print("No matching projects", file=sys.stderr)
+        return 1
+    report = asyncio.run(run_calculate(project_ids, args.objective, args.workers))
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        for project in report["projects"]:
+            seconds = f"{project['seconds']:9.3f}s" if project["seconds"] is not None else " " * 10
+            error = f"  {project['error']}" if project["error"] else ""
+            print(f"project {project['project_id']:>6}  {project['status']:<10} {project['objective']:<15} {seconds}{error}")
+        print(f"load {report['load_seconds']:.3f}s  solve {report['solve_seconds']:.3f}s  save {report['save_seconds']:.3f}s")
+    return 1 if any(project["status"] == "failed" for project in report["projects"]) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    calc = commands.add_parser("calculate", help="recalculate the results of several projects")
+    scope = calc.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--all", action="store_true", help="every finalised project")
+    scope.add_argument("--admin", help="projects owned by the admin with this email")
+    scope.add_argument("--department", help="projects owned by admins of this department")
+    scope.add_argument("--project", type=int, action="append", help="project id (repeatable)")
+    calc.add_argument("--objective", choices=algorithm.OBJECTIVES,
+                      help="solver objective (default: the one of each project's stored results)")
+    calc.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="solver processes")
+    calc.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    database.Base.metadata.create_all(bind=database.engine)
+    run_migrations(database.engine)
+    sys.exit(calculate(args))
+
+
+if __name__ == "__main__":
+    main()
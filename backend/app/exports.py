@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from typing import Iterable, Iterator, Tuple
+from openpyxl import Workbook
+from sqlalchemy import select
+from . import models, database
+
+# Rows fetched from the database per round trip, and rows encoded per yielded chunk
+EXPORT_BATCH_SIZE = 1000
+# Bytes per chunk when sending a finished file
+FILE_CHUNK_SIZE = 64 * 1024
+
+HEADER = ("Student ID", "Assigned Project")
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "excel": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXTENSIONS = {"json": "json", "ndjson": "ndjson", "txt": "txt", "csv": "csv", "excel": "xlsx"}
+
+
+def result_rows(project_id: int) -> Iterator[Tuple[str, str]]:
+    """
+    (student number, assigned option title) for every student of the project, read in
+    batches from a server-side cursor. Uses its own session because the response body
+    is produced after the request's session has been closed.
+    """
+    db = database.SessionLocal()
+    try:
+        rows = db.execute(
+            select(models.Student.student_number, models.Option.title)
+            .outerjoin(models.Option, models.Option.id == models.Student.assigned_option_id)
+            .where(models.Student.project_id == project_id)
+            .order_by(models.Student.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        for student_number, title in rows:
+            yield student_number, title or "Unassigned"
+    finally:
+        db.close()
+
+
+def _batched(rows: Iterable, size: int = EXPORT_BATCH_SIZE) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_delimited(rows: Iterable[Tuple[str, str]], delimiter: str) -> Iterator[bytes]:
+    """CSV (or tab separated TXT) with a header line, one chunk per batch of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\n")
+    writer.writerow(HEADER)
+    for batch in _batched(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def stream_txt(rows: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """Tab separated lines as before, without the quoting csv would add."""
+    yield ("\t".join(HEADER) + "\n").encode()
+    for batch in _batched(rows):
+        yield "".join(f"{student}\t{option}\n" for student, option in batch).encode()
+
+
+def stream_json(rows: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """The JSON array of {"Student ID", "Assigned Project"} objects, written incrementally."""
+    yield b"["
+    first = True
+    for batch in _batched(rows):
+        items = ",".join(json.dumps(dict(zip(HEADER, row))) for row in batch)
+        yield (items if first else "," + items).encode()
+        first = False
+    yield b"]"
+
+
+def stream_ndjson(rows: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    for batch in _batched(rows):
+        yield "".join(json.dumps(dict(zip(HEADER, row))) + "\n" for row in batch).encode()
+
+
+def stream_xlsx(rows: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Workbook built in openpyxl's write-only mode, which streams rows into a temporary
+    file instead of keeping cells in memory. The finished file is sent in chunks.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Results")
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+
+    handle, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(handle)
+    try:
+        workbook.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    yield from stream_file(path)
+
+
+def stream_file(path: str, remove_dir: bool = False) -> Iterator[bytes]:
+    """Sends a finished temporary file in chunks and deletes it (or its directory) afterwards."""
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(FILE_CHUNK_SIZE):
+                yield chunk
+    finally:
+        if remove_dir:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+WRITERS = {
+    "json": stream_json,
+    "ndjson": stream_ndjson,
+    "txt": stream_txt,
+    "csv": lambda rows: stream_delimited(rows, ","),
+    "excel": stream_xlsx,
+}
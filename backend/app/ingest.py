@@ -0,0 +1,412 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+try:
+    import fcntl
+except ImportError: # Windows: logs are not locked, run a single worker
+    fcntl = None
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from . import models, database
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_students = models.Student.__table__
+_projects = models.Project.__table__
+
+
+class SubmissionBuffer:
+    """
+    Write-behind buffer for student submissions (INGEST_BUFFER=true).
+
+    A submission is acknowledged once it is fsynced to this worker's append-only log.
+    A writer thread appends and fsyncs waiting submissions together. A flusher thread
+    group-commits them into the students and preferences tables every flush interval,
+    or as soon as a full batch is waiting. The log is emptied whenever everything in
+    it has been committed.
+
+    Each worker process owns one log file, locked while the worker runs. On start,
+    logs that no running worker holds (left behind by a crash) are replayed. Replays
+    are idempotent: students that already exist are skipped via the unique
+    (project, student number) index.
+
+    Before a submission is checked and logged, its student is claimed with a file
+    under claims/ in the log directory, which the owning worker removes once the
+    submission is committed or rejected. The claims keep a student from being
+    buffered by two workers at once and tell a closing form what it still waits for.
+    """
+
+    def __init__(self, engine: Engine, log_dir: str, batch_size: int, flush_interval: float):
+        self.engine = engine
+        self.log_dir = log_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._queue: "queue.Queue[Optional[Tuple[dict, Future]]]" = queue.Queue()
+        self._keys = set() # (project_id, student_number) claimed here but not yet committed
+        self._queued = 0 # Accepted, waiting for the log
+        self._pending: List[dict] = [] # In the log, waiting for the database
+        self._inflight = 0 # Taken by the flusher, not yet committed
+        self._stopping = False
+        self._log = None
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.log_dir, f"submissions-{os.getpid()}.log")
+
+    @property
+    def claims_dir(self) -> str:
+        return os.path.join(self.log_dir, "claims")
+
+    def start(self):
+        if self._log is not None:
+            return
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.replay()
+        # Claims carrying this process id were left by an earlier process with the same id
+        for path in glob.glob(os.path.join(self.claims_dir, "*", "*")):
+            if self._claim_owner(path) == os.getpid():
+                self._unclaim(path)
+        self._stopping = False
+        self._log = open(self.log_path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._threads = [
+            threading.Thread(target=self._write_loop, name="ingest-writer", daemon=True),
+            threading.Thread(target=self._flush_loop, name="ingest-flusher", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Flushes everything that was accepted and stops the threads."""
+        if self._log is None:
+            return
+        self._queue.put(None)
+        self._threads[0].join()
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._threads[1].join()
+        self._log.close()
+        self._log = None
+        # Anything left could not be written (database unavailable); keep it for the next start
+        if not self._pending:
+            os.remove(self.log_path)
+
+    def replay(self):
+        """Commits the records of logs that no running worker holds, then deletes them."""
+        for path in sorted(glob.glob(os.path.join(self.log_dir, "submissions-*.log"))):
+            try:
+                log = open(path, "r+")
+            except FileNotFoundError: # Replayed by another worker in the meantime
+                continue
+            with log:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError: # Owned by a running worker
+                        continue
+                records = []
+                for line in log:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError: # Torn write from the crash, never acknowledged
+                        continue
+                for start in range(0, len(records), self.batch_size):
+                    self._commit(records[start:start + self.batch_size])
+                if records:
+                    logger.info("Replayed %d buffered submissions from %s", len(records), path)
+                owner = int(os.path.basename(path)[len("submissions-"):-len(".log")])
+                for record in records:
+                    claim = self._claim_path(record["project_id"], record["student_number"])
+                    if self._claim_owner(claim) == owner:
+                        self._unclaim(claim)
+                os.remove(path)
+
+    def is_pending(self, project_id: int, student_number: str) -> bool:
+        with self._cond:
+            return (project_id, student_number) in self._keys
+
+    def reserve(self, project_id: int, student_number: str) -> bool:
+        """
+        Claims the student for a submission to the project. Returns False if a running
+        worker (this one included) already buffers a submission for them. Call
+        release if the submission is then rejected, or submit to log it.
+        """
+        key = (project_id, student_number)
+        with self._cond:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+        claimed = False
+        try:
+            claimed = self._claim(self._claim_path(*key))
+        finally:
+            if not claimed:
+                with self._cond:
+                    self._keys.discard(key)
+        return claimed
+
+    def release(self, project_id: int, student_number: str):
+        """Gives up a claim taken by reserve for a submission that was not logged."""
+        with self._cond:
+            self._keys.discard((project_id, student_number))
+            self._cond.notify_all()
+        self._unclaim(self._claim_path(project_id, student_number))
+
+    async def submit(self, project_id: int, student_number: str, preferences: List[Tuple[int, int]]):
+        """Appends a submission reserved with reserve to the log and returns once it is durable."""
+        with self._cond:
+            self._queued += 1
+        done = Future()
+        self._queue.put(({"project_id": project_id, "student_number": student_number, "preferences": preferences}, done))
+        await asyncio.wrap_future(done)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every accepted submission is committed. Returns False on timeout."""
+        with self._cond:
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._idle, timeout=timeout)
+
+    def drain_project(self, project_id: int, timeout: float) -> bool:
+        """
+        Waits until no worker holds a claim for the project, that is until every
+        submission for it is committed or rejected. Submissions claim their student
+        before they check that the form is open, so once the form is marked closed
+        this covers every submission that will ever be acknowledged for it. Claims of
+        workers that stopped are dropped after their logs are replayed. Returns False
+        on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+        while self._claims(project_id):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.flush_interval, remaining))
+        return True
+
+    def has_claims(self, project_id: int) -> bool:
+        """Whether any running worker buffers a submission for the project."""
+        return bool(self._claims(project_id))
+
+    def _claims(self, project_id: int) -> List[str]:
+        """Claim files for the project held by running workers."""
+        try:
+            names = os.listdir(os.path.join(self.claims_dir, str(project_id)))
+        except FileNotFoundError:
+            return []
+        claims = [os.path.join(self.claims_dir, str(project_id), name) for name in names if "." not in name]
+        stale = [path for path in claims if not self._owner_running(path)]
+        if stale:
+            if fcntl is not None: # Without locks every log looks abandoned
+                self.replay()
+            for path in stale:
+                self._unclaim(path)
+        return [path for path in claims if path not in stale]
+
+    def _claim_path(self, project_id: int, student_number: str) -> str:
+        digest = hashlib.sha256(student_number.encode()).hexdigest()
+        return os.path.join(self.claims_dir, str(project_id), digest)
+
+    def _claim(self, path: str) -> bool:
+        """Creates the claim file, written in full before it appears under its name."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        draft = f"{path}.{os.getpid()}"
+        with open(draft, "w") as f:
+            f.write(str(os.getpid()))
+        try:
+            for _ in range(2):
+                try:
+                    os.link(draft, path)
+                    return True
+                except FileExistsError:
+                    if self._owner_running(path):
+                        return False
+                # Left by a worker that stopped: its log is replayed first, so a submission
+                # behind the claim is in the database before the caller looks for duplicates
+                if fcntl is not None:
+                    self.replay()
+                self._unclaim(path)
+            return False
+        finally:
+            os.remove(draft)
+
+    def _unclaim(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _claim_owner(self, path: str) -> Optional[int]:
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _owner_running(self, path: str) -> bool:
+        """Whether the worker that took the claim still runs, judged by the lock on its log."""
+        owner = self._claim_owner(path)
+        if owner is None:
+            return False
+        if owner == os.getpid():
+            return True
+        if fcntl is None: # A single worker, so the claim is from an earlier run
+            return False
+        try:
+            log = open(os.path.join(self.log_dir, f"submissions-{owner}.log"))
+        except FileNotFoundError:
+            return False
+        with log:
+            try:
+                fcntl.flock(log, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+        return False
+
+    @property
+    def _idle(self) -> bool:
+        return not self._queued and not self._pending and not self._inflight
+
+    def _write_loop(self):
+        stop = False
+        while not stop:
+            items = [self._queue.get()]
+            # Everything that queued up during the last fsync shares the next one
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in items
+            items = [item for item in items if item is not None]
+            if not items:
+                continue
+
+            try:
+                self._log.write("".join(json.dumps(record) + "\n" for record, _ in items))
+                self._log.flush()
+                os.fsync(self._log.fileno())
+            except Exception as e:
+                with self._cond:
+                    self._queued -= len(items)
+                    for record, _ in items:
+                        self._keys.discard((record["project_id"], record["student_number"]))
+                    self._cond.notify_all()
+                for record, _ in items:
+                    self._unclaim(self._claim_path(record["project_id"], record["student_number"]))
+                for _, done in items:
+                    done.set_exception(e)
+                continue
+
+            with self._cond:
+                self._queued -= len(items)
+                self._pending.extend(record for record, _ in items)
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+            for _, done in items:
+                done.set_result(None)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._pending) >= self.batch_size or self._stopping,
+                    timeout=self.flush_interval,
+                )
+                if self._stopping and not self._pending:
+                    return
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                self._inflight = len(batch)
+            if not batch:
+                continue
+
+            committed = True
+            try:
+                self._commit(batch)
+            except OperationalError:
+                # Database unavailable or locked for too long: keep the batch and retry
+                logger.exception("Flushing %d buffered submissions failed, retrying", len(batch))
+                committed = False
+
+            with self._cond:
+                self._inflight = 0
+                if committed:
+                    for record in batch:
+                        self._keys.discard((record["project_id"], record["student_number"]))
+                    if self._idle:
+                        self._log.truncate(0)
+                else:
+                    self._pending[:0] = batch
+                self._cond.notify_all()
+            if committed:
+                for record in batch:
+                    self._unclaim(self._claim_path(record["project_id"], record["student_number"]))
+            if not committed:
+                if self._stopping:
+                    return
+                time.sleep(self.flush_interval)
+
+    def _commit(self, records: List[dict]):
+        """Writes records in one transaction, falling back to one at a time if the batch is rejected."""
+        try:
+            self._insert(records)
+        except OperationalError:
+            raise
+        except Exception:
+            if len(records) == 1:
+                logger.exception("Dropping buffered submission %s", records[0])
+                return
+            for record in records:
+                self._commit([record])
+
+    def _insert(self, records: List[dict]):
+        dialect_insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        with database.write_lock(self.engine), self.engine.begin() as conn:
+            # Students already in the database (replays, duplicates across workers) are skipped
+            inserted = conn.execute(
+                dialect_insert(_students)
+                .values([{"project_id": r["project_id"], "student_number": r["student_number"]} for r in records])
+                .on_conflict_do_nothing()
+                .returning(_students.c.id, _students.c.project_id, _students.c.student_number)
+            ).all()
+            student_ids: Dict[Tuple[int, str], int] = {
+                (row.project_id, row.student_number): row.id for row in inserted
+            }
+            preferences = [
+                {"student_id": student_ids[(r["project_id"], r["student_number"])], "option_id": option_id, "rank": rank}
+                for r in records if (r["project_id"], r["student_number"]) in student_ids
+                for option_id, rank in r["preferences"]
+            ]
+            if preferences:
+                conn.execute(models.Preference.__table__.insert(), preferences)
+            for project_id in {row.project_id for row in inserted}:
+                conn.execute(
+                    update(_projects)
+                    .where(_projects.c.id == project_id)
+                    .values(revision=_projects.c.revision + 1)
+                )
+
+
+buffer = SubmissionBuffer(
+    database.engine,
+    settings.INGEST_LOG_DIR,
+    settings.INGEST_BATCH_SIZE,
+    settings.INGEST_FLUSH_INTERVAL_MS / 1000,
+)
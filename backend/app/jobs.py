@@ -0,0 +1,393 @@
+import asyncio
+import multiprocessing
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, update
+from starlette.concurrency import run_in_threadpool
+from . import models, database, algorithm, metrics
+from .auth import settings
+
+# Rough share of the work done once a job reaches each stage
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "loading": 0.1,
+    "solving": 0.3,
+    "saving": 0.9,
+    "done": 1.0,
+    "failed": 1.0,
+}
+
+# Finished jobs are kept this long so clients can still poll them
+JOB_RETENTION_SECONDS = 3600
+
+# Solver states kept for incremental re-solves (most recently used projects)
+SOLVER_STATE_LIMIT = 32
+
+
+def bump_revision(db, project_id: int):
+    """
+    Marks a change to a project's options or submissions. Stored results are only
+    reused while the project is still at the revision they were calculated for.
+    Call inside the transaction that makes the change.
+    """
+    db.query(models.Project).filter(models.Project.id == project_id).update(
+        {models.Project.revision: models.Project.revision + 1}, synchronize_session=False
+    )
+
+
+def load_problem(project_id: int, objective: str = "sum"):
+    """
+    Reads the solver input for a project in its own session.
+    Returns None when the stored results already match the current revision and objective.
+    """
+    problem = load_problems([project_id], objective).get(project_id)
+    if problem is None:
+        raise ValueError("Project not found")
+    revision, _, students, options = problem
+    if students is None:
+        return None
+    return revision, students, options
+
+
+def load_problems(project_ids: List[int], objective: Optional[str] = None, force: bool = False) -> Dict[int, tuple]:
+    """
+    Reads the solver input of several projects in one pass, with one query per table
+    for all of them. objective None keeps the objective of each project's stored results.
+    Returns {project_id: (revision, objective, students, options)}, where students and
+    options are None for projects whose stored results are current (unless force is
+    set). Unknown projects are left out.
+    """
+    db = database.SessionLocal()
+    try:
+        projects = db.query(
+            models.Project.id, models.Project.revision, models.Project.results_revision, models.Project.results_objective
+        ).filter(models.Project.id.in_(project_ids)).all()
+        problems: Dict[int, tuple] = {}
+        for project_id, revision, results_revision, results_objective in projects:
+            wanted = objective or results_objective or "sum"
+            current = not force and results_revision == revision and (results_objective or "sum") == wanted
+            problems[project_id] = (revision, wanted, None, None) if current else (revision, wanted, [], [])
+        pending = [project_id for project_id, problem in problems.items() if problem[2] is not None]
+        if not pending:
+            return problems
+
+        # Flat queries instead of lazy-loading the preferences of every student
+        prefs: Dict[int, Dict[int, int]] = {}
+        for project_id, student_id in (
+            db.query(models.Student.project_id, models.Student.id)
+            .filter(models.Student.project_id.in_(pending)).order_by(models.Student.id)
+        ):
+            prefs[student_id] = {}
+            problems[project_id][2].append({"id": student_id, "preferences": prefs[student_id]})
+        rows = (
+            db.query(models.Preference.student_id, models.Preference.option_id, models.Preference.rank)
+            .join(models.Student, models.Student.id == models.Preference.student_id)
+            .filter(models.Student.project_id.in_(pending))
+        )
+        for student_id, option_id, rank in rows:
+            prefs[student_id][option_id] = rank
+        for project_id, option_id, capacity, min_capacity in (
+            db.query(models.Option.project_id, models.Option.id, models.Option.capacity, models.Option.min_capacity)
+            .filter(models.Option.project_id.in_(pending)).order_by(models.Option.id)
+        ):
+            problems[project_id][3].append({"id": option_id, "capacity": capacity, "min_capacity": min_capacity})
+        return problems
+    finally:
+        db.close()
+
+
+def save_assignments(project_id: int, revision: int, students: List[Dict], assignments: Dict[int, int], objective: str = "sum"):
+    """Writes the solver output back onto the project's students (see save_batch)."""
+    save_batch([(project_id, revision, objective, students, assignments)])
+
+
+# One executemany batch per save: rows are matched by primary key and project, so a
+# student deleted while its project was being solved is skipped instead of failing the save
+_assign_students = (
+    update(models.Student.__table__)
+    .where(models.Student.id == bindparam("student_id"), models.Student.project_id == bindparam("student_project_id"))
+    .values(assigned_option_id=bindparam("option_id"))
+)
+
+
+def save_batch(results: List[tuple]):
+    """
+    Writes the solver output of several projects in one transaction: one executemany
+    update over all their students (students left unassigned are reset, so no stale
+    assignment survives) and one update per project.
+    results: (project_id, revision, objective, students, assignments) per project
+    """
+    rows = [
+        {"student_id": student["id"], "student_project_id": project_id, "option_id": assignments.get(student["id"])}
+        for project_id, _, _, students, assignments in results
+        for student in students
+    ]
+    db = database.SessionLocal()
+    try:
+        with database.write_lock(db.get_bind()):
+            if rows:
+                db.execute(_assign_students, rows)
+            for project_id, revision, objective, _, _ in results:
+                db.query(models.Project).filter(models.Project.id == project_id).update(
+                    {models.Project.results_revision: revision, models.Project.results_objective: objective},
+                    synchronize_session=False
+                )
+            db.commit()
+    finally:
+        db.close()
+
+
+def _timed_solve(students, options, previous, objective):
+    """solve_assignment_incremental plus its duration, measured in the worker process."""
+    started = time.perf_counter()
+    assignments, state = algorithm.solve_assignment_incremental(students, options, previous, "auto", objective)
+    return assignments, state, time.perf_counter() - started
+
+
+class Job:
+    def __init__(self, project_id: int, objective: str = "sum"):
+        self.id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.objective = objective
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        # The event loop only keeps a weak reference to tasks, so the job holds its own
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def progress(self) -> float:
+        return STAGE_PROGRESS[self.status]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "project_id": self.project_id,
+            "status": self.status,
+            "objective": self.objective,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs result calculations in the background. Loading and saving happen in the
+    threadpool, the solve itself in a process pool so it never holds the GIL of the
+    web worker. Only one job per project and objective runs at a time; a second
+    request for the same project and objective joins the running job, also when
+    that job is part of a batch. The solver state of each finished job is kept so
+    the next calculation for that project and objective only repairs what changed.
+
+    Jobs live in memory of the current process, so with several uvicorn workers a
+    job can only be polled on the worker that created it.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        # Both keyed by (project_id, objective)
+        self._active: Dict[Tuple[int, str], Job] = {}
+        self._states: "OrderedDict[Tuple[int, str], dict]" = OrderedDict()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def submit(self, project_id: int, objective: str = "sum") -> Job:
+        """Starts a calculation for the project, or returns the one already running."""
+        active = self._active.get((project_id, objective))
+        if active and not active.finished:
+            return active
+
+        job = self._register(project_id, objective)
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+        return job
+
+    def _register(self, project_id: int, objective: str) -> Job:
+        self._purge()
+        job = Job(project_id, objective)
+        self._jobs[job.id] = job
+        self._active[(project_id, objective)] = job
+        return job
+
+    def _finish(self, job: Job, error: Optional[str] = None):
+        if error is not None:
+            metrics.solver_failures.inc()
+            job.error = error
+        job.status = "failed" if error is not None else "done"
+        job.finished_at = time.time()
+        if self._active.get((job.project_id, job.objective)) is job:
+            del self._active[(job.project_id, job.objective)]
+        job.done.set()
+
+    def _keep_state(self, job: Job, state: dict):
+        self._states[(job.project_id, job.objective)] = state
+        while len(self._states) > SOLVER_STATE_LIMIT:
+            self._states.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def _run(self, job: Job):
+        error = None
+        try:
+            job.status = "loading"
+            started = time.perf_counter()
+            problem = await run_in_threadpool(load_problem, job.project_id, job.objective)
+            metrics.solver_seconds.observe(time.perf_counter() - started, "load")
+            if problem is None:
+                return
+            revision, students, options = problem
+
+            job.status = "solving"
+            loop = asyncio.get_running_loop()
+            previous = self._states.pop((job.project_id, job.objective), None)
+            started = time.perf_counter()
+            try:
+                assignments, state = await loop.run_in_executor(
+                    self.executor, algorithm.solve_assignment_incremental, students, options, previous, "auto", job.objective
+                )
+            except BrokenProcessPool:
+                # A crashed worker takes the whole pool down; start a fresh one next time
+                self.shutdown()
+                raise
+            metrics.solver_seconds.observe(time.perf_counter() - started, "solve")
+            self._keep_state(job, state)
+
+            job.status = "saving"
+            started = time.perf_counter()
+            await run_in_threadpool(save_assignments, job.project_id, revision, students, assignments, job.objective)
+            metrics.solver_seconds.observe(time.perf_counter() - started, "save")
+        except Exception as e:
+            error = str(e)
+        finally:
+            self._finish(job, error)
+
+    async def run_batch(self, project_ids: List[int], objective: Optional[str] = None) -> dict:
+        """
+        Recalculates several projects at once: one read pass over the database, the
+        solves spread over the process pool, then one write pass for all of them.
+        Projects with current results are reported as cached. A project that already
+        has a job running for the same objective is not solved again: the batch waits
+        for that job and reports its outcome (without a solve time). The batch
+        registers a job for every other project it solves, which later requests join.
+        A failed solve only fails its own project. Returns the status and solve time
+        per project, in the order given, plus the time of each stage.
+        """
+        started = time.perf_counter()
+        problems = await run_in_threadpool(load_problems, project_ids, objective)
+        load_seconds = time.perf_counter() - started
+        metrics.solver_seconds.observe(load_seconds, "load")
+
+        loop = asyncio.get_running_loop()
+        reports = {
+            project_id: {"project_id": project_id, "status": "cached" if students is None else "solving",
+                         "objective": project_objective, "seconds": None, "error": None}
+            for project_id, (_, project_objective, students, _) in problems.items()
+        }
+        for project_id in project_ids:
+            reports.setdefault(project_id, {"project_id": project_id, "status": "failed", "objective": objective or "sum",
+                                            "seconds": None, "error": "Project not found"})
+
+        joined: Dict[int, Job] = {}
+        batch_jobs: Dict[int, Job] = {}
+        for project_id, (_, project_objective, students, _) in problems.items():
+            if students is None:
+                continue
+            active = self._active.get((project_id, project_objective))
+            if active and not active.finished:
+                joined[project_id] = active
+            else:
+                batch_jobs[project_id] = self._register(project_id, project_objective)
+                batch_jobs[project_id].status = "solving"
+
+        async def solve(project_id):
+            _, project_objective, students, options = problems[project_id]
+            previous = self._states.pop((project_id, project_objective), None)
+            return await loop.run_in_executor(
+                self.executor, _timed_solve, students, options, previous, project_objective
+            )
+
+        errors: Dict[int, Optional[str]] = {}
+        try:
+            started = time.perf_counter()
+            pending = list(batch_jobs)
+            outcomes = await asyncio.gather(*(solve(project_id) for project_id in pending), return_exceptions=True)
+            solve_seconds = time.perf_counter() - started
+            if any(isinstance(outcome, BrokenProcessPool) for outcome in outcomes):
+                # A crashed worker takes the whole pool down; start a fresh one next time
+                self.shutdown()
+
+            solved = []
+            for project_id, outcome in zip(pending, outcomes):
+                report = reports[project_id]
+                if isinstance(outcome, BaseException):
+                    errors[project_id] = str(outcome) or type(outcome).__name__
+                    report.update(status="failed", error=errors[project_id])
+                    continue
+                assignments, state, seconds = outcome
+                metrics.solver_seconds.observe(seconds, "solve")
+                self._keep_state(batch_jobs[project_id], state)
+                batch_jobs[project_id].status = "saving"
+                revision, project_objective, students, _ = problems[project_id]
+                solved.append((project_id, revision, project_objective, students, assignments))
+                report.update(status="calculated", seconds=round(seconds, 6))
+
+            started = time.perf_counter()
+            if solved:
+                try:
+                    await run_in_threadpool(save_batch, solved)
+                except Exception as e:
+                    for project_id, *_ in solved:
+                        errors[project_id] = str(e)
+                        reports[project_id].update(status="failed", error=errors[project_id])
+                    raise
+                metrics.solver_seconds.observe(time.perf_counter() - started, "save")
+            save_seconds = time.perf_counter() - started
+        finally:
+            for project_id, job in batch_jobs.items():
+                self._finish(job, errors.get(project_id, None if job.status == "saving" else "Batch aborted"))
+
+        for project_id, job in joined.items():
+            await job.done.wait()
+            reports[project_id].update(status="failed" if job.error is not None else "calculated", error=job.error)
+
+        return {
+            "projects": [reports[project_id] for project_id in project_ids],
+            "load_seconds": round(load_seconds, 6),
+            "solve_seconds": round(solve_seconds, 6),
+            "save_seconds": round(save_seconds, 6),
+        }
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+manager = JobManager(max_workers=settings.SOLVER_WORKERS)
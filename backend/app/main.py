@@ -1,13 +1,28 @@
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from .routers import admin, projects, students
-from .database import engine, Base
+from . import jobs, ingest, auth, metrics
+from .migrations import run_migrations
+from .database import engine, async_engine, Base
 from .auth import settings
 
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
-app = FastAPI(title="Group Assignment API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.INGEST_BUFFER:
+        ingest.buffer.start()
+    yield
+    if settings.INGEST_BUFFER:
+        ingest.buffer.stop()
+    jobs.manager.shutdown()
+    auth.password_hasher.shutdown()
+    await async_engine.dispose()
+
+app = FastAPI(title="Group Assignment API", lifespan=lifespan)
 
 # Security Headers Middleware
 @app.middleware("http")
@@ -40,6 +55,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it is the outermost layer and its timings include the other middleware
+if settings.METRICS_ENABLED:
+    metrics.instrument_engines()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 app.include_router(projects.router, prefix="/api/projects", tags=["projects"])
 app.include_router(students.router, prefix="/api/students", tags=["students"])
@@ -0,0 +1,190 @@
+import bisect
+import contextvars
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Sequence, Tuple
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from . import database, auth
+
+# Metrics are kept in the memory of each worker process and carry its pid as the
+# "worker" label, so series of several uvicorn workers stay apart (sum them in queries).
+# They are only updated and rendered on the event loop, which makes locks unnecessary.
+WORKER = str(os.getpid())
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+SOLVER_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name, self.documentation, self.labels = name, documentation, ("worker", *labels)
+        self.values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[(WORKER, *labels)] += amount
+
+    def render(self, kind: str = "counter"):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {kind}"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    def dec(self, *labels: str, amount: float = 1):
+        self.values[(WORKER, *labels)] -= amount
+
+    def render(self):
+        return super().render("gauge")
+
+
+class Histogram:
+    """Cumulative buckets, sum and count per label combination, as Prometheus expects them."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name, self.documentation, self.labels = name, documentation, ("worker", *labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple[str, ...], list] = {}
+        self.sums: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def observe(self, value: float, *labels: str):
+        key = (WORKER, *labels)
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1 # First bucket with value <= bound, else +Inf
+        self.sums[key] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels((*self.labels, 'le'), (*labels, bound))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {self.sums[labels]}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+REQUEST_LABELS = ("method", "route", "status")
+request_seconds = Histogram("http_request_duration_seconds", "Time until the response body was sent.", REQUEST_LABELS, LATENCY_BUCKETS)
+requests_in_flight = Gauge("http_requests_in_flight", "Requests being handled right now.")
+request_statements = Histogram("http_request_sql_statements", "SQL statements executed per request.", REQUEST_LABELS, STATEMENT_BUCKETS)
+request_sql_seconds = Histogram("http_request_sql_duration_seconds", "Time spent in SQL statements per request.", REQUEST_LABELS, LATENCY_BUCKETS)
+solver_seconds = Histogram("solver_stage_duration_seconds", "Duration of the load, solve and save stages of result calculations.", ("stage",), SOLVER_BUCKETS)
+solver_failures = Counter("solver_failures_total", "Result calculations that failed.")
+password_hash_rejected = Counter("password_hash_rejected_total", "Hash and verify operations turned away because the pool was full.")
+password_hash_in_progress = Gauge("password_hash_in_progress", "Hash and verify operations waiting or running.")
+
+METRICS = (
+    request_seconds, requests_in_flight, request_statements, request_sql_seconds,
+    solver_seconds, solver_failures, password_hash_rejected, password_hash_in_progress,
+)
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+# The stats of the request being handled. Sync endpoints run in the threadpool with a copy
+# of the context and async engine calls run in greenlets sharing it, so both see this object.
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info["metrics_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.pop("metrics_started", None)
+    if stats is not None and started is not None:
+        stats.statements += 1
+        stats.sql_seconds += time.perf_counter() - started
+
+
+def instrument_engines():
+    """Counts statements and their time on the app's engines, for the request being handled."""
+    for bind in (database.engine, database.async_engine.sync_engine):
+        if not event.contains(bind, "before_cursor_execute", _before_cursor_execute):
+            event.listen(bind, "before_cursor_execute", _before_cursor_execute)
+            event.listen(bind, "after_cursor_execute", _after_cursor_execute)
+
+
+def route_template(scope) -> str:
+    """
+    Path template of the matched route, e.g. /api/projects/{project_id}/results. Routes of
+    included routers may only know their path below the router's prefix, which is then
+    taken from the request path: the template has as many segments as the path.
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    parts = scope["path"].split("/")
+    prefix_length = len(parts) - len(route.path.split("/"))
+    return "/".join(parts[:prefix_length + 1]) + route.path if prefix_length > 0 else route.path
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request and records its SQL statements per route template (not per
+    path, which would create a series per project id). The Server-Timing header covers
+    the time until the response headers are sent; a streamed body keeps counting into
+    the histograms until it has been sent in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = (time.perf_counter() - start) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", (
+                    f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.statements} statements", '
+                    f"app;dur={elapsed:.1f}"
+                ))
+            await send(message)
+
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            requests_in_flight.dec()
+            _current.reset(token)
+            labels = (scope["method"], route_template(scope), str(status))
+            request_seconds.observe(time.perf_counter() - start, *labels)
+            request_statements.observe(stats.statements, *labels)
+            request_sql_seconds.observe(stats.sql_seconds, *labels)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    pool = auth.password_hasher.stats()
+    password_hash_rejected.values[(WORKER,)] = pool["rejected"]
+    password_hash_in_progress.values[(WORKER,)] = pool["in_progress"]
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
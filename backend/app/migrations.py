@@ -0,0 +1,44 @@
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+# Unique indexes that could not be created because the table holds duplicates
+skipped_indexes = set()
+
+
+def run_migrations(engine: Engine):
+    """
+    Brings databases created by older versions up to date with the models.
+    create_all only creates missing tables, so columns and indexes added to
+    existing tables are added here. New columns must be nullable or carry a
+    server_default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with engine.begin() as conn:
+                    index.create(bind=conn, checkfirst=True)
+            except IntegrityError:
+                # Existing duplicates block a unique index. Code that relies on the index
+                # checks skipped_indexes and looks for duplicates itself until the rows are
+                # cleaned up and the app restarted
+                skipped_indexes.add(index.name)
+                logger.warning("Could not create unique index %s: table %s contains duplicates", index.name, table.name)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -11,6 +11,7 @@ class Admin(Base):
     department = Column(String)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
+    token_version = Column(Integer, default=0, server_default="0") # Bumped to revoke issued tokens
 
     projects = relationship("Project", back_populates="owner")
 
@@ -24,6 +25,9 @@ class Project(Base):
     is_closed = Column(Boolean, default=False) # "closed" for submissions
     archived = Column(Boolean, default=False)
     owner_id = Column(Integer, ForeignKey("admins.id"))
+    revision = Column(Integer, default=0, server_default="0") # Bumped on every change to options/submissions
+    results_revision = Column(Integer, nullable=True) # Revision the stored assignments were calculated for
+    results_objective = Column(String, nullable=True) # Solver objective of the stored assignments (None: sum)
 
     owner = relationship("Admin", back_populates="projects")
     options = relationship("Option", back_populates="project", cascade="all, delete-orphan")
@@ -33,18 +37,25 @@ class Option(Base):
     __tablename__ = "options"
 
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"))
+    project_id = Column(Integer, ForeignKey("projects.id"), index=True)
     title = Column(String)
     description = Column(Text)
     requirements = Column(Text, nullable=True)
     supervisors = Column(String, nullable=True)
     capacity = Column(Integer, default=50)
+    min_capacity = Column(Integer, default=0, server_default="0") # Below this the option is closed (gets no students)
     
     project = relationship("Project", back_populates="options")
     # preferences = relationship("Preference", back_populates="option")
 
+# One submission per student number and project; also serves per-project scans
+STUDENT_NUMBER_INDEX = "ix_students_project_student_number"
+
 class Student(Base):
     __tablename__ = "students"
+    __table_args__ = (
+        Index(STUDENT_NUMBER_INDEX, "project_id", "student_number", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
@@ -58,7 +69,7 @@ class Preference(Base):
     __tablename__ = "preferences"
 
     id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"))
+    student_id = Column(Integer, ForeignKey("students.id"), index=True)
     option_id = Column(Integer, ForeignKey("options.id"))
     rank = Column(Integer) # 1 is highest preference
 
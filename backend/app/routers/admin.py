@@ -1,11 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from .. import models, schemas, database, auth
-from datetime import timedelta
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter()
 
+def set_session_cookie(response: Response, user: models.Admin) -> str:
+    access_token = auth.create_admin_token(user)
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=True,
+        max_age=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        expires=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        samesite="lax",
+        secure=auth.settings.ENVIRONMENT == "production"
+    )
+    return access_token
+
 @router.post("/register", response_model=schemas.AdminResponse)
 def register(admin: schemas.AdminCreate, db: Session = Depends(database.get_db)):
     if admin.register_code != auth.settings.REGISTER_SECRET:
@@ -15,7 +28,7 @@ def register(admin: schemas.AdminCreate, db: Session = Depends(database.get_db))
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_pwd = auth.get_password_hash(admin.password)
+    hashed_pwd = auth.password_hasher.run("hash", auth.get_password_hash, admin.password)
     new_admin = models.Admin(
         name=admin.name,
         sirname=admin.sirname,
@@ -29,24 +42,25 @@ def register(admin: schemas.AdminCreate, db: Session = Depends(database.get_db))
     return new_admin
 
 @router.post("/login", response_model=schemas.AdminToken)
-def login_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.Admin).filter(models.Admin.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
-    
-    access_token_expires = timedelta(minutes=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
-    
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        max_age=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        expires=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        samesite="lax",
-        secure=auth.settings.ENVIRONMENT == "production"
+async def login_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    user = await run_in_threadpool(
+        lambda: db.query(models.Admin).filter(models.Admin.email == form_data.username).first()
     )
+    valid, new_hash = False, None
+    if user:
+        # Waits on the password pool without holding a thread; a full pool answers 503 right away
+        valid, new_hash = await auth.password_hasher.run_async(
+            "verify", auth.verify_and_update_password, form_data.password, user.hashed_password
+        )
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
+
+    # Stored with an outdated cost factor, replace it while the plain password is at hand
+    if new_hash:
+        user.hashed_password = new_hash
+        await run_in_threadpool(db.commit)
     
+    access_token = set_session_cookie(response, user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/logout")
@@ -55,12 +69,13 @@ def logout(response: Response):
     return {"message": "Logged out successfully"}
 
 @router.get("/me", response_model=schemas.AdminResponse)
-def read_users_me(current_user: models.Admin = Depends(auth.get_current_user)):
+def read_users_me(current_user: models.Admin = Depends(auth.get_current_admin)):
     return current_user
 
 @router.put("/me", response_model=schemas.AdminResponse)
-def update_profile(profile: schemas.AdminUpdate, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
-    if profile.email and profile.email != current_user.email:
+def update_profile(profile: schemas.AdminUpdate, response: Response, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_admin)):
+    email_changed = bool(profile.email and profile.email != current_user.email)
+    if email_changed:
         existing = db.query(models.Admin).filter(models.Admin.email == profile.email).first()
         if existing:
             raise HTTPException(status_code=400, detail="Email already in use by another account")
@@ -73,39 +88,39 @@ def update_profile(profile: schemas.AdminUpdate, db: Session = Depends(database.
     if profile.department is not None:
         current_user.department = profile.department
     
-    db.commit()
+    if email_changed:
+        # Sessions opened under the old email end; this one continues with a new token
+        auth.revoke_tokens(db, current_user)
+        set_session_cookie(response, current_user)
+    else:
+        db.commit()
     db.refresh(current_user)
     return current_user
 
 @router.put("/me/password")
-def change_password(password_data: schemas.PasswordChange, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
-    if not auth.verify_password(password_data.current_password, current_user.hashed_password):
+def change_password(password_data: schemas.PasswordChange, response: Response, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_admin)):
+    if not auth.password_hasher.run("verify", auth.verify_password, password_data.current_password, current_user.hashed_password):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     if len(password_data.new_password) < 8:
         raise HTTPException(status_code=400, detail="New password must be at least 8 characters")
     
-    current_user.hashed_password = auth.get_password_hash(password_data.new_password)
-    db.commit()
+    current_user.hashed_password = auth.password_hasher.run("hash", auth.get_password_hash, password_data.new_password)
+    # Log out every other session; this one continues with a new token
+    auth.revoke_tokens(db, current_user)
+    set_session_cookie(response, current_user)
     return {"status": "success", "message": "Password updated successfully"}
 
 @router.post("/refresh", response_model=schemas.AdminToken)
-def refresh_token(response: Response, current_user: models.Admin = Depends(auth.get_current_user)):
+def refresh_token(response: Response, current_user: models.Admin = Depends(auth.get_current_admin)):
     """
     Refreshes the current access token.
     This creates a sliding session: as long as the user is valid, they can get a new token.
     """
-    access_token_expires = timedelta(minutes=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(data={"sub": current_user.email}, expires_delta=access_token_expires)
-    
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        max_age=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        expires=auth.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        samesite="lax",
-        secure=auth.settings.ENVIRONMENT == "production"
-    )
-    
+    access_token = set_session_cookie(response, current_user)
     return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/metrics/password-hashing")
+def password_hashing_metrics(current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    """Usage and latency of the password hashing pool in this worker."""
+    return auth.password_hasher.stats()
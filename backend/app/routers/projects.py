@@ -1,18 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import func
-from .. import models, schemas, database, auth, algorithm
+from sqlalchemy.exc import IntegrityError
+from .. import models, schemas, database, auth, jobs, ingest, cache, exports, bulk, algorithm, scenarios
 import uuid
-import pandas as pd
-from io import BytesIO
-import json
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
 @router.post("/", response_model=schemas.ProjectResponse)
-def create_project(project: schemas.ProjectCreate, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def create_project(project: schemas.ProjectCreate, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     unique_code = str(uuid.uuid4())[:8]
     
     db_project = models.Project(
@@ -31,7 +30,8 @@ def create_project(project: schemas.ProjectCreate, db: Session = Depends(databas
             description=opt.description,
             requirements=opt.requirements,
             supervisors=opt.supervisors,
-            capacity=opt.capacity
+            capacity=opt.capacity,
+            min_capacity=opt.min_capacity
         )
         db.add(db_option)
     
@@ -40,14 +40,26 @@ def create_project(project: schemas.ProjectCreate, db: Session = Depends(databas
     return db_project
 
 @router.get("/", response_model=List[schemas.ProjectListResponse])
-def get_projects(db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
-    projects = db.query(models.Project).filter(models.Project.owner_id == current_user.id).all()
-    
+def get_projects(db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    projects = (
+        db.query(models.Project)
+        .options(selectinload(models.Project.options))
+        .filter(models.Project.owner_id == current_user.id)
+        .all()
+    )
+
+    # One grouped query instead of a count per project; capacities come from the
+    # options that are already loaded
+    submission_counts = dict(
+        db.query(models.Student.project_id, func.count(models.Student.id))
+        .join(models.Project, models.Project.id == models.Student.project_id)
+        .filter(models.Project.owner_id == current_user.id)
+        .group_by(models.Student.project_id)
+        .all()
+    )
+
     result = []
     for project in projects:
-        submission_count = db.query(models.Student).filter(models.Student.project_id == project.id).count()
-        total_capacity = db.query(func.sum(models.Option.capacity)).filter(models.Option.project_id == project.id).scalar() or 0
-        
         result.append({
             "id": project.id,
             "title": project.title,
@@ -56,14 +68,49 @@ def get_projects(db: Session = Depends(database.get_db), current_user: models.Ad
             "is_closed": project.is_closed,
             "archived": project.archived,
             "options": project.options,
-            "submission_count": submission_count,
-            "total_capacity": total_capacity
+            "submission_count": submission_counts.get(project.id, 0),
+            "total_capacity": sum(o.capacity or 0 for o in project.options)
         })
     
     return result
 
+@router.post("/calculate", response_model=schemas.BatchCalculationResponse)
+async def calculate_batch(request: schemas.BatchCalculationRequest, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    if request.objective is not None and request.objective not in algorithm.OBJECTIVES:
+        raise HTTPException(status_code=400, detail=f"Invalid objective, use one of: {', '.join(algorithm.OBJECTIVES)}")
+
+    def owned_project_ids():
+        query = db.query(models.Project.id).filter(models.Project.owner_id == current_user.id)
+        if request.project_ids is None:
+            query = query.filter(models.Project.is_active.is_(True), models.Project.archived.is_(False))
+        else:
+            query = query.filter(models.Project.id.in_(request.project_ids))
+        return [row[0] for row in query.order_by(models.Project.id)]
+
+    project_ids = await run_in_threadpool(owned_project_ids)
+    if request.project_ids is not None and len(project_ids) != len(set(request.project_ids)):
+        raise HTTPException(status_code=404, detail="Project not found")
+    return await jobs.manager.run_batch(project_ids, request.objective)
+
+@router.get("/bulk-export")
+def bulk_export_projects(format: str = bulk.DEFAULT_FORMAT, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project_ids = [row[0] for row in db.query(models.Project.id).filter(models.Project.owner_id == current_user.id)]
+    return bulk_export_response(project_ids, format, "all_projects")
+
+def bulk_export_response(project_ids: List[int], format: str, name: str):
+    if format not in bulk.FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    if format == "parquet" and bulk.pa is None:
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server, use format=csv")
+    archive = bulk.export_archive(project_ids, format)
+    return StreamingResponse(
+        exports.stream_file(archive, remove_dir=True),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={name}_{format}.zip"},
+    )
+
 @router.get("/{project_id}", response_model=schemas.ProjectResponse)
-def get_project(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def get_project(project_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -72,18 +119,20 @@ def get_project(project_id: int, db: Session = Depends(database.get_db), current
     return project
 
 @router.put("/{project_id}", response_model=schemas.ProjectResponse)
-def update_project(project_id: int, project_data: schemas.ProjectCreate, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def update_project(project_id: int, project_data: schemas.ProjectCreate, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
     submission_count = db.query(models.Student).filter(models.Student.project_id == project_id).count()
-    if submission_count > 0:
+    # Buffered submissions were checked against the current options and must stay valid
+    if submission_count > 0 or (auth.settings.INGEST_BUFFER and ingest.buffer.has_claims(project_id)):
         raise HTTPException(status_code=400, detail="Cannot edit project with existing submissions")
     
     project.title = project_data.title
     
     db.query(models.Option).filter(models.Option.project_id == project_id).delete()
+    jobs.bump_revision(db, project_id)
     
     for opt in project_data.options:
         db_option = models.Option(
@@ -92,100 +141,181 @@ def update_project(project_id: int, project_data: schemas.ProjectCreate, db: Ses
             description=opt.description,
             requirements=opt.requirements,
             supervisors=opt.supervisors,
-            capacity=opt.capacity
+            capacity=opt.capacity,
+            min_capacity=opt.min_capacity
         )
         db.add(db_option)
     
     db.commit()
     db.commit()
+    cache.invalidate_project(project.unique_code)
     db.refresh(project)
     project.submission_count = 0
     return project
 
 @router.delete("/{project_id}")
-def delete_project(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def delete_project(project_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    # Remove the submissions first with set-based deletes: students reference options,
+    # which databases that enforce foreign keys (PostgreSQL) check, and the ORM cascade
+    # does not know to delete students before options
+    student_ids = db.query(models.Student.id).filter(models.Student.project_id == project_id)
+    db.query(models.Preference).filter(models.Preference.student_id.in_(student_ids)).delete(synchronize_session=False)
+    db.query(models.Student).filter(models.Student.project_id == project_id).delete(synchronize_session=False)
+    db.expire(project, ["students"])
+    unique_code = project.unique_code
     db.delete(project)
     db.commit()
+    cache.invalidate_project(unique_code)
     return {"status": "deleted"}
 
 @router.put("/{project_id}/finalise")
-def finalise_project(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def finalise_project(project_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     project.is_active = True
     db.commit()
+    cache.invalidate_project(project.unique_code)
     return {"status": "success"}
 
 @router.put("/{project_id}/close")
-def close_project(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def close_project(project_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    # Stop new submissions first, then wait until the buffered ones are in the database;
+    # if they cannot all be saved in time, the form is opened again
     project.is_closed = True
     db.commit()
+    cache.invalidate_project(project.unique_code)
+    if auth.settings.INGEST_BUFFER and not ingest.buffer.drain_project(project.id, auth.settings.INGEST_CLOSE_TIMEOUT_SECONDS):
+        project.is_closed = False
+        db.commit()
+        cache.invalidate_project(project.unique_code)
+        raise HTTPException(
+            status_code=503, detail="Buffered submissions are still being saved, please try again",
+            headers={"Retry-After": "5"},
+        )
     return {"status": "success"}
 
+def calculation_objective(db: Session, project: models.Project, objective: Optional[str]) -> str:
+    """
+    The requested objective, or else the one the stored results were calculated with.
+    Rejects unknown objectives and objectives that cannot honour minimum capacities.
+    """
+    objective = objective or project.results_objective or "sum"
+    if objective not in algorithm.OBJECTIVES:
+        raise HTTPException(status_code=400, detail=f"Invalid objective, use one of: {', '.join(algorithm.OBJECTIVES)}")
+    if objective != "sum" and db.query(models.Option.id).filter(
+        models.Option.project_id == project.id, models.Option.min_capacity > 0
+    ).first():
+        raise HTTPException(status_code=400, detail="Minimum capacities are only supported by the sum objective")
+    return objective
+
 @router.post("/{project_id}/calculate")
-def calculate_results(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
-    project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+async def calculate_results(project_id: int, objective: Optional[str] = None, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    
-    students = db.query(models.Student).filter(models.Student.project_id == project_id).all()
-    
-    student_data = []
-    for s in students:
-        prefs = {}
-        for p in s.preferences:
-            prefs[p.option_id] = p.rank
-        student_data.append({"id": s.id, "preferences": prefs})
-        
-    options = [{"id": o.id, "capacity": o.capacity} for o in project.options]
-    
-    assignments = algorithm.solve_assignment(student_data, options)
-    
-    for s in students:
-        if s.id in assignments:
-            s.assigned_option_id = assignments[s.id]
-            
-    db.commit()
-    return {"status": "calculated"}
+    objective = await run_in_threadpool(calculation_objective, db, project, objective)
+
+    # Nothing changed since the last calculation, the stored assignments are current
+    if project.results_revision == project.revision and (project.results_objective or "sum") == objective:
+        return {"status": "calculated", "cached": True, "objective": objective}
+
+    # Waiting on the background job keeps the threadpool free while the solve runs
+    job = jobs.manager.submit(project_id, objective)
+    await job.done.wait()
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Calculation failed: {job.error}")
+    return {"status": "calculated", "cached": False, "objective": objective}
+
+@router.post("/{project_id}/jobs", response_model=schemas.JobStatus, status_code=202)
+async def submit_calculation(project_id: int, objective: Optional[str] = None, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    objective = await run_in_threadpool(calculation_objective, db, project, objective)
+
+    job = jobs.manager.submit(project_id, objective)
+    return job.to_dict()
+
+@router.get("/{project_id}/jobs/{job_id}", response_model=schemas.JobStatus)
+async def get_calculation(project_id: int, job_id: str, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    job = jobs.manager.get(job_id)
+    if not job or job.project_id != project_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/{project_id}/scenarios", response_model=schemas.ScenarioResponse)
+async def explore_scenarios(project_id: int, request: schemas.ScenarioRequest, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not 0 < len(request.scenarios) <= scenarios.SCENARIO_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {scenarios.SCENARIO_LIMIT} scenarios")
+    objective = await run_in_threadpool(calculation_objective, db, project, request.objective)
+
+    named = [(s.name or f"scenario {i + 1}", s.capacities) for i, s in enumerate(request.scenarios)]
+    try:
+        return await scenarios.run_scenarios(project_id, named, objective)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{project_id}/results", response_model=List[schemas.AssignmentResult])
-def get_results(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def get_results(project_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-        
+
+    rows = (
+        db.query(models.Student.student_number, models.Student.assigned_option_id, models.Option.title)
+        .join(models.Option, models.Option.id == models.Student.assigned_option_id)
+        .filter(models.Student.project_id == project_id)
+        .all()
+    )
+
     results = []
-    students = db.query(models.Student).filter(models.Student.project_id == project_id).all()
-    
-    options_map = {o.id: o.title for o in project.options}
-    
-    for s in students:
-        if s.assigned_option_id:
-            results.append({
-                "student_number": s.student_number,
-                "assigned_option_title": options_map.get(s.assigned_option_id, "Unknown"),
-                "assigned_option_id": s.assigned_option_id
-            })
-            
+    for student_number, assigned_option_id, option_title in rows:
+        results.append({
+            "student_number": student_number,
+            "assigned_option_title": option_title,
+            "assigned_option_id": assigned_option_id
+        })
+    return results
+
 @router.get("/{project_id}/students", response_model=List[schemas.StudentDetail])
-def get_students(project_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def get_students(project_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    students = db.query(models.Student).filter(models.Student.project_id == project_id).all()
+    students = (
+        db.query(models.Student)
+        .options(selectinload(models.Student.preferences))
+        .filter(models.Student.project_id == project_id)
+        .all()
+    )
     return students
 
 @router.put("/{project_id}/students/{student_id}")
-def update_student(project_id: int, student_id: int, update_data: schemas.StudentUpdate, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def update_student(project_id: int, student_id: int, update_data: schemas.StudentUpdate, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -216,12 +346,17 @@ def update_student(project_id: int, student_id: int, update_data: schemas.Studen
                 rank=pref.rank
             )
             db.add(db_pref)
-            
-    db.commit()
+
+    jobs.bump_revision(db, project_id)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Student number already exists")
     return {"status": "updated"}
 
 @router.delete("/{project_id}/students/{student_id}")
-def delete_student(project_id: int, student_id: int, db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def delete_student(project_id: int, student_id: int, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -231,47 +366,47 @@ def delete_student(project_id: int, student_id: int, db: Session = Depends(datab
         raise HTTPException(status_code=404, detail="Student not found")
         
     db.delete(student)
+    jobs.bump_revision(db, project_id)
     db.commit()
     return {"status": "deleted"}
 
 @router.get("/{project_id}/export")
-def export_results(project_id: int, format: str = "json", db: Session = Depends(database.get_db), current_user: models.Admin = Depends(auth.get_current_user)):
+def export_results(project_id: int, format: str = "json", db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
     project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
         
-    results = []
-    students = db.query(models.Student).filter(models.Student.project_id == project_id).all()
-    options_map = {o.id: o.title for o in project.options}
-    
-    for s in students:
-        assigned_option = options_map.get(s.assigned_option_id, "Unassigned")
-        results.append({
-            "Student ID": s.student_number,
-            "Assigned Project": assigned_option
-        })
-    
-    if format == "json":
-        return results
-    elif format == "txt":
-        content = "Student ID\tAssigned Project\n"
-        for r in results:
-            content += f"{r['Student ID']}\t{r['Assigned Project']}\n"
-        return StreamingResponse(
-            BytesIO(content.encode()),
-            media_type="text/plain",
-            headers={"Content-Disposition": f"attachment; filename=results_{project_id}.txt"}
-        )
-    elif format == "excel":
-        df = pd.DataFrame(results)
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Results')
-        output.seek(0)
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename=results_{project_id}.xlsx"}
-        )
-    else:
+    if format not in exports.WRITERS:
         raise HTTPException(status_code=400, detail="Invalid format")
+
+    # Rows are read with a cursor and encoded batch by batch while the response is sent
+    headers = {}
+    if format != "json":
+        headers["Content-Disposition"] = f"attachment; filename=results_{project_id}.{exports.EXTENSIONS[format]}"
+    return StreamingResponse(
+        exports.WRITERS[format](exports.result_rows(project_id)),
+        media_type=exports.MEDIA_TYPES[format],
+        headers=headers,
+    )
+
+@router.get("/{project_id}/bulk-export")
+def bulk_export_project(project_id: int, format: str = bulk.DEFAULT_FORMAT, db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return bulk_export_response([project_id], format, f"project_{project_id}")
+
+@router.post("/{project_id}/bulk-import")
+def bulk_import_preferences(project_id: int, file: UploadFile = File(...), db: Session = Depends(database.get_db), current_user: auth.CurrentAdmin = Depends(auth.get_current_user)):
+    project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    try:
+        preferences = bulk.read_preferences(file.file, file.filename or "")
+        preference_count = bulk.import_preferences(db, project_id, preferences)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="The file contains students that have already submitted preferences for this project")
+    return {"status": "imported", "students": len(preferences), "preferences": preference_count}
@@ -1,6 +1,10 @@
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Response, Request, status
+from sqlalchemy import select, insert, update, bindparam
 from sqlalchemy.orm import Session
-from .. import models, schemas, database, auth
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from .. import models, schemas, database, auth, ingest, cache, migrations
 from datetime import timedelta
 from jose import jwt, JWTError
 
@@ -31,7 +35,7 @@ def get_current_student(request: Request):
 
 @router.get("/validate/{unique_code}/{student_number}")
 def validate_entry(unique_code: str, student_number: str, response: Response, db: Session = Depends(database.get_db)):
-    project = db.query(models.Project).filter(models.Project.unique_code == unique_code).first()
+    project = cache.get_project(db, unique_code)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -72,49 +76,119 @@ def validate_entry(unique_code: str, student_number: str, response: Response, db
     }
 
 @router.get("/options/{unique_code}", response_model=schemas.ProjectResponse)
-def get_project_options(unique_code: str, db: Session = Depends(database.get_db), student_auth: dict = Depends(get_current_student)):
+def get_project_options(unique_code: str, request: Request, db: Session = Depends(database.get_db), student_auth: dict = Depends(get_current_student)):
     # Verify the token matches the requested code
     if student_auth["unique_code"] != unique_code:
         raise HTTPException(status_code=403, detail="Not authorized for this project")
 
-    project = db.query(models.Project).filter(models.Project.unique_code == unique_code).first()
+    project = cache.get_project(db, unique_code)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    return project
+
+    # Browsers revalidate every time and skip the body while the options are unchanged
+    headers = {"ETag": project.etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == project.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=project.options_json, media_type="application/json", headers=headers)
+
+# Core statements on the tables, built once. Going through the ORM bulk-insert path and
+# building the statements per request cost more than the inserts themselves.
+_projects = models.Project.__table__
+_students = models.Student.__table__
+_SELECT_PROJECT = (
+    select(_projects.c.id, _projects.c.is_active, _projects.c.is_closed)
+    .where(_projects.c.unique_code == bindparam("unique_code"))
+)
+_SELECT_STUDENT = (
+    select(_students.c.id)
+    .where(_students.c.project_id == bindparam("project_id"), _students.c.student_number == bindparam("student_number"))
+)
+_INSERT_STUDENT = insert(_students).returning(_students.c.id)
+_INSERT_PREFERENCES = insert(models.Preference.__table__)
+_BUMP_REVISION = (
+    update(_projects)
+    .where(_projects.c.id == bindparam("project_id"))
+    .values(revision=_projects.c.revision + 1)
+)
 
 @router.post("/submit")
-def submit_choices(submission: schemas.StudentSubmission, db: Session = Depends(database.get_db), student_auth: dict = Depends(get_current_student)):
+async def submit_choices(submission: schemas.StudentSubmission, db: AsyncSession = Depends(database.get_async_db), student_auth: dict = Depends(get_current_student)):
     # Verify token matches submission
     if student_auth["unique_code"] != submission.project_code or student_auth["student_number"] != submission.student_id:
          raise HTTPException(status_code=403, detail="Submission data does not match authenticated session")
 
-    project = db.query(models.Project).filter(models.Project.unique_code == submission.project_code).first()
+    project = (await db.execute(_SELECT_PROJECT, {"unique_code": submission.project_code})).first()
     if not project or not project.is_active or project.is_closed:
         raise HTTPException(status_code=400, detail="Invalid project state")
-    
-    existing_student = db.query(models.Student).filter(
-        models.Student.student_number == submission.student_id,
-        models.Student.project_id == project.id
-    ).first()
-    
-    if existing_student:
-        raise HTTPException(status_code=409, detail="This student ID has already submitted preferences for this project")
-    
-    student = models.Student(
-        project_id=project.id,
-        student_number=submission.student_id
-    )
-    db.add(student)
-    db.commit()
-    db.refresh(student)
-        
-    for pref in submission.preferences:
-        db_pref = models.Preference(
-            student_id=student.id,
-            option_id=pref.option_id,
-            rank=pref.rank
-        )
-        db.add(db_pref)
-        
-    db.commit()
+
+    if auth.settings.INGEST_BUFFER:
+        return await buffer_submission(submission, project.id, db)
+
+    # One transaction: the student row, all preferences in a single executemany and the
+    # revision bump. Duplicates are rejected by the unique index on (project, student number),
+    # or looked for first on an old database where that index could not be created.
+    async with database.async_write_lock(db.bind):
+        if models.STUDENT_NUMBER_INDEX in migrations.skipped_indexes and (await db.execute(
+            _SELECT_STUDENT, {"project_id": project.id, "student_number": submission.student_id}
+        )).first():
+            raise HTTPException(status_code=409, detail="This student ID has already submitted preferences for this project")
+        try:
+            student_id = (await db.execute(
+                _INSERT_STUDENT, {"project_id": project.id, "student_number": submission.student_id}
+            )).scalar_one()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="This student ID has already submitted preferences for this project")
+
+        if submission.preferences:
+            await db.execute(_INSERT_PREFERENCES, [
+                {"student_id": student_id, "option_id": pref.option_id, "rank": pref.rank}
+                for pref in submission.preferences
+            ])
+        await db.execute(_BUMP_REVISION, {"project_id": project.id})
+        await db.commit()
+    return {"status": "success"}
+
+_options = models.Option.__table__
+# One row per option of the project (one with a NULL option id if it has none)
+_SELECT_PROJECT_STATE = (
+    select(_projects.c.is_active, _projects.c.is_closed, _options.c.id.label("option_id"))
+    .select_from(_projects.outerjoin(_options, _options.c.project_id == _projects.c.id))
+    .where(_projects.c.id == bindparam("project_id"))
+)
+
+def invalid_preferences(preferences: List[schemas.PreferenceItem], option_ids: set) -> Optional[str]:
+    """Why the preferences cannot be stored for a project with these options, or None."""
+    if any(pref.option_id not in option_ids for pref in preferences):
+        return "Preferences name an option outside this project"
+    if len({pref.option_id for pref in preferences}) != len(preferences):
+        return "An option is ranked more than once"
+    return None
+
+async def buffer_submission(submission: schemas.StudentSubmission, project_id: int, db: AsyncSession):
+    """
+    Acknowledges the submission once it is in the ingest log; the flusher commits it.
+    The student is claimed before the project state is read again, so a form that is
+    being closed waits for every submission that gets past the check. Everything the
+    database could reject is checked before the log, since nobody hears of a
+    submission dropped later.
+    """
+    duplicate = HTTPException(status_code=409, detail="This student ID has already submitted preferences for this project")
+    if not ingest.buffer.reserve(project_id, submission.student_id):
+        raise duplicate
+    try:
+        rows = (await db.execute(_SELECT_PROJECT_STATE, {"project_id": project_id})).all()
+        if not rows or not rows[0].is_active or rows[0].is_closed:
+            raise HTTPException(status_code=400, detail="Invalid project state")
+        problem = invalid_preferences(submission.preferences, {row.option_id for row in rows})
+        if problem:
+            raise HTTPException(status_code=400, detail=problem)
+        existing = (await db.execute(_SELECT_STUDENT, {"project_id": project_id, "student_number": submission.student_id})).first()
+        if existing:
+            raise duplicate
+    except BaseException:
+        ingest.buffer.release(project_id, submission.student_id)
+        raise
+    preferences = [(pref.option_id, pref.rank) for pref in submission.preferences]
+    await ingest.buffer.submit(project_id, submission.student_id, preferences)
     return {"status": "success"}
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from . import algorithm, jobs
+
+# Scenarios accepted per request, each one is a full solve
+SCENARIO_LIMIT = 20
+
+
+def scenario_stats(assigned: np.ndarray, student_idx: np.ndarray, option_idx: np.ndarray,
+                   rank: np.ndarray, num_options: int) -> dict:
+    """Satisfaction figures of one assignment (option index per student, -1 if unassigned)."""
+    seated = assigned >= 0
+    match = assigned[student_idx] == option_idx
+    received = np.zeros(assigned.size, dtype=np.int64) # Rank each student got, 0 if unranked or unseated
+    received[student_idx[match]] = rank[match]
+    ranked = received[received > 0]
+    counts = np.bincount(ranked)
+    return {
+        "students": int(assigned.size),
+        "assigned": int(seated.sum()),
+        "unassigned": int((~seated).sum()),
+        "unranked": int((seated & (received == 0)).sum()),
+        "rank_counts": {int(r): int(counts[r]) for r in np.flatnonzero(counts)},
+        "first_choice_share": round(float((received == 1).mean()), 4) if assigned.size else 0.0,
+        "mean_rank": round(float(ranked.mean()), 4) if ranked.size else None,
+        "worst_rank": int(ranked.max()) if ranked.size else None,
+        "loads": np.bincount(assigned[seated], minlength=num_options).tolist(),
+    }
+
+
+def solve_scenario(block_name: str, num_preferences: int, num_students: int,
+                   capacities: np.ndarray, minimums: np.ndarray, objective: str) -> dict:
+    """
+    Runs in a pool worker: solves one capacity vector on the preference arrays in
+    the shared block (student_idx, option_idx and rank, one row each) and returns
+    its statistics and solve time.
+    """
+    started = time.perf_counter()
+    # Pool workers share the resource tracker of the web worker, which unlinks the block
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        arrays = np.ndarray((3, num_preferences), dtype=np.int64, buffer=block.buf)
+        assigned = algorithm.solve_assignment_arrays(num_students, capacities, *arrays, "auto", minimums, objective)
+        stats = scenario_stats(assigned, *arrays, len(capacities))
+        del arrays # The view must be gone before the block can be closed
+    finally:
+        try:
+            block.close()
+        except BufferError:
+            pass # The traceback of a failed solve still holds a view; the block closes once it is dropped
+    stats["seconds"] = round(time.perf_counter() - started, 6)
+    return stats
+
+
+def scenario_capacities(options: List[Dict], overrides: Dict[int, int]) -> np.ndarray:
+    """
+    Capacity vector in option order: the stored capacities with the overrides applied.
+    An option whose capacity is below its minimum cannot run, so it is closed.
+    """
+    known = {opt["id"] for opt in options}
+    unknown = set(overrides) - known
+    if unknown:
+        raise ValueError(f"Unknown option ids for this project: {', '.join(map(str, sorted(unknown)))}")
+    if any(capacity < 0 for capacity in overrides.values()):
+        raise ValueError("Capacities cannot be negative")
+    capacities = np.array([overrides.get(opt["id"], opt["capacity"]) for opt in options], dtype=np.int64)
+    _, minimums = algorithm.option_bounds(options)
+    capacities[capacities < minimums] = 0
+    return capacities
+
+
+async def run_scenarios(project_id: int, scenarios: List[Tuple[str, Dict[int, int]]], objective: str) -> dict:
+    """
+    Solves the project once with its stored capacities and once per scenario, all in
+    the solver process pool, without touching the stored assignments. The preference
+    arrays are built once and placed in shared memory, so every worker reads the same
+    copy instead of receiving its own through a pipe. Raises ValueError for invalid
+    scenarios.
+    """
+    problem = (await run_in_threadpool(jobs.load_problems, [project_id], objective, True)).get(project_id)
+    if problem is None:
+        raise ValueError("Project not found")
+    _, objective, students, options = problem
+    option_ids = [opt["id"] for opt in options]
+    capacities, minimums = algorithm.option_bounds(options)
+    vectors: List[Tuple[str, np.ndarray]] = [("current", capacities)]
+    vectors += [(name, scenario_capacities(options, overrides)) for name, overrides in scenarios]
+
+    student_idx, option_idx, rank = await run_in_threadpool(algorithm.preferences_to_arrays, students, options)
+    arrays = np.stack((student_idx, option_idx, rank))
+    block = shared_memory.SharedMemory(create=True, size=max(arrays.nbytes, 1))
+    try:
+        np.ndarray(arrays.shape, dtype=np.int64, buffer=block.buf)[:] = arrays
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(*(
+            loop.run_in_executor(
+                jobs.manager.executor, solve_scenario, block.name, rank.size, len(students), vector, minimums, objective
+            )
+            for _, vector in vectors
+        ), return_exceptions=True)
+    finally:
+        block.close()
+        block.unlink()
+    if any(isinstance(outcome, BrokenProcessPool) for outcome in outcomes):
+        # A crashed worker takes the whole pool down; start a fresh one next time
+        jobs.manager.shutdown()
+
+    results = []
+    for (name, vector), outcome in zip(vectors, outcomes):
+        result = {
+            "name": name,
+            "capacities": dict(zip(option_ids, vector.tolist())),
+            "status": "solved",
+            "error": None,
+        }
+        if isinstance(outcome, BaseException):
+            result.update(status="failed", error=str(outcome) or type(outcome).__name__)
+        else:
+            outcome["loads"] = dict(zip(option_ids, outcome["loads"]))
+            result.update(outcome)
+        results.append(result)
+    return {"objective": objective, "baseline": results[0], "scenarios": results[1:]}
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, model_validator
+from typing import Dict, List, Optional
 
 class AdminBase(BaseModel):
     name: str
@@ -32,9 +32,16 @@ class OptionBase(BaseModel):
     requirements: Optional[str] = None
     supervisors: Optional[str] = None
     capacity: int = 50
+    min_capacity: int = 0
 
 class OptionCreate(OptionBase):
-    pass
+    @model_validator(mode="after")
+    def check_capacities(self):
+        if self.capacity < 0 or self.min_capacity < 0:
+            raise ValueError("Capacities cannot be negative")
+        if self.min_capacity > self.capacity:
+            raise ValueError("Minimum capacity cannot exceed the capacity")
+        return self
 
 class OptionResponse(OptionBase):
     id: int
@@ -74,11 +81,73 @@ class PreferenceItem(BaseModel):
     option_id: int
     rank: int
 
+    @model_validator(mode="after")
+    def check_rank(self):
+        if self.rank < 1:
+            raise ValueError("Ranks must be 1 or higher")
+        return self
+
 class StudentSubmission(BaseModel):
     project_code: str
     student_id: str
     preferences: List[PreferenceItem]
 
+class JobStatus(BaseModel):
+    job_id: str
+    project_id: int
+    status: str
+    objective: str = "sum"
+    progress: float
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+class BatchCalculationRequest(BaseModel):
+    project_ids: Optional[List[int]] = None # None: every finalised project that is not archived
+    objective: Optional[str] = None # None: the objective of each project's stored results
+
+class BatchProjectStatus(BaseModel):
+    project_id: int
+    status: str
+    objective: str
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+class BatchCalculationResponse(BaseModel):
+    projects: List[BatchProjectStatus]
+    load_seconds: float
+    solve_seconds: float
+    save_seconds: float
+
+class Scenario(BaseModel):
+    name: Optional[str] = None
+    capacities: Dict[int, int] # option id -> capacity; options left out keep their stored capacity
+
+class ScenarioRequest(BaseModel):
+    scenarios: List[Scenario]
+    objective: Optional[str] = None
+
+class ScenarioResult(BaseModel):
+    name: str
+    capacities: Dict[int, int]
+    status: str
+    error: Optional[str] = None
+    seconds: Optional[float] = None
+    students: Optional[int] = None
+    assigned: Optional[int] = None
+    unassigned: Optional[int] = None
+    unranked: Optional[int] = None
+    rank_counts: Dict[int, int] = {} # rank -> students who got an option of that rank
+    first_choice_share: Optional[float] = None
+    mean_rank: Optional[float] = None
+    worst_rank: Optional[int] = None
+    loads: Dict[int, int] = {} # option id -> students assigned
+
+class ScenarioResponse(BaseModel):
+    objective: str
+    baseline: ScenarioResult # The stored capacities
+    scenarios: List[ScenarioResult]
+
 class AssignmentResult(BaseModel):
     student_number: str
     assigned_option_title: str
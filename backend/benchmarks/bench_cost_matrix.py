@@ -0,0 +1,77 @@
+"""
+Micro-benchmark for building the slot-expanded cost matrix used by the Hungarian solve.
+
+Compares the original nested-loop fill (students -> preferences -> seats) against the
+vectorized build_cost_matrix path that takes flat preference arrays.
+
+Run from the backend directory:
+    python -m benchmarks.bench_cost_matrix
+"""
+import time
+import numpy as np
+from app import algorithm
+
+NUM_OPTIONS = 40
+CAPACITY = 50
+PREFS_PER_STUDENT = 5
+
+
+def legacy_cost_matrix(students, options):
+    # The fill loop solve_assignment used before preferences were passed as arrays
+    slots = []
+    for opt in options:
+        for _ in range(max(1, opt['capacity'])):
+            slots.append(opt['id'])
+
+    cost_matrix = np.full((len(students), len(slots)), algorithm.UNRANKED_COST)
+
+    option_to_cols = {}
+    for col_idx, opt_id in enumerate(slots):
+        option_to_cols.setdefault(opt_id, []).append(col_idx)
+
+    for i, student in enumerate(students):
+        for opt_id, rank in student['preferences'].items():
+            if opt_id in option_to_cols:
+                for col_idx in option_to_cols[opt_id]:
+                    cost_matrix[i, col_idx] = rank
+    return cost_matrix
+
+
+def make_cohort(num_students, seed=0):
+    rng = np.random.default_rng(seed)
+    options = [{'id': j + 1, 'capacity': CAPACITY} for j in range(NUM_OPTIONS)]
+    students = []
+    for i in range(num_students):
+        ranked = rng.choice(NUM_OPTIONS, size=PREFS_PER_STUDENT, replace=False) + 1
+        students.append({'id': i + 1, 'preferences': {int(o): r + 1 for r, o in enumerate(ranked)}})
+    return students, options
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    print(f"{'students':>8} {'cells':>12} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8} {'bytes loop':>12} {'bytes vec':>12}")
+    for num_students in (1_000, 5_000, 10_000):
+        students, options = make_cohort(num_students)
+        capacities = np.array([opt['capacity'] for opt in options])
+
+        legacy, legacy_time = timed(legacy_cost_matrix, students, options)
+
+        def vectorized():
+            arrays = algorithm.preferences_to_arrays(students, options)
+            return algorithm.build_cost_matrix(num_students, capacities, *arrays)[0]
+
+        fast, fast_time = timed(vectorized)
+        assert np.array_equal(legacy, fast)
+
+        print(f"{num_students:>8} {legacy.size:>12} {legacy_time:>10.3f} {fast_time:>15.3f} "
+              f"{legacy_time / fast_time:>7.1f}x {legacy.nbytes:>12} {fast.nbytes:>12}")
+        del legacy, fast
+
+
+if __name__ == "__main__":
+    main()
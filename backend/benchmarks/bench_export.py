@@ -0,0 +1,123 @@
+"""
+Peak memory and time of the results export, materialized versus streaming.
+
+"legacy txt" and "legacy excel" rebuild the original export: all students loaded as
+ORM objects, TXT built by string concatenation, Excel as a regular in-memory openpyxl
+workbook (what the pandas DataFrame path wrote through). The streaming writers from
+app.exports read the rows from a cursor and are consumed chunk by chunk the way the
+response would send them. Peak memory is measured with tracemalloc.
+
+Run from the backend directory:
+    python -m benchmarks.bench_export --sizes 10000 50000 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+os.chdir(tempfile.mkdtemp(prefix="bench_export_"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("REGISTER_SECRET", "benchmark")
+os.environ.setdefault("PASSWORD_PEPPER", "benchmark")
+os.environ["DATABASE_URL"] = "sqlite:///./group_assignment.db"
+
+from openpyxl import Workbook
+from app import database, exports, models
+
+NUM_OPTIONS = 40
+
+
+def setup_project(num_students):
+    db = database.SessionLocal()
+    project = models.Project(title=f"Export {num_students}", unique_code=f"exp{num_students}")
+    db.add(project)
+    db.flush()
+    options = [
+        models.Option(project_id=project.id, title=f"Option {j} with a realistic length title", description="", capacity=50)
+        for j in range(NUM_OPTIONS)
+    ]
+    db.add_all(options)
+    db.flush()
+    db.execute(models.Student.__table__.insert(), [
+        {"project_id": project.id, "student_number": f"i{n:07d}", "assigned_option_id": options[n % NUM_OPTIONS].id}
+        for n in range(num_students)
+    ])
+    db.commit()
+    project_id = project.id
+    db.close()
+    return project_id
+
+
+def legacy_results(project_id):
+    db = database.SessionLocal()
+    try:
+        project = db.query(models.Project).filter(models.Project.id == project_id).first()
+        students = db.query(models.Student).filter(models.Student.project_id == project_id).all()
+        options_map = {o.id: o.title for o in project.options}
+        return [
+            {"Student ID": s.student_number, "Assigned Project": options_map.get(s.assigned_option_id, "Unassigned")}
+            for s in students
+        ]
+    finally:
+        db.close()
+
+
+def legacy_txt(project_id):
+    content = "Student ID\tAssigned Project\n"
+    for r in legacy_results(project_id):
+        content += f"{r['Student ID']}\t{r['Assigned Project']}\n"
+    return len(content.encode())
+
+
+def legacy_excel(project_id):
+    results = legacy_results(project_id)
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Results"
+    sheet.append(exports.HEADER)
+    for r in results:
+        sheet.append((r["Student ID"], r["Assigned Project"]))
+    output = BytesIO()
+    workbook.save(output)
+    return len(output.getvalue())
+
+
+def streamed(fmt):
+    def run(project_id):
+        return sum(len(chunk) for chunk in exports.WRITERS[fmt](exports.result_rows(project_id)))
+    return run
+
+
+CASES = {
+    "legacy txt": legacy_txt,
+    "stream txt": streamed("txt"),
+    "stream csv": streamed("csv"),
+    "stream ndjson": streamed("ndjson"),
+    "legacy excel": legacy_excel,
+    "stream excel": streamed("excel"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    args = parser.parse_args()
+
+    database.Base.metadata.create_all(bind=database.engine)
+    for size in args.sizes:
+        project_id = setup_project(size)
+        print(f"{size} students")
+        for name, case in CASES.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            written = case(project_id)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {name:<14} {written / 1e6:7.2f} MB written  peak {peak / 1e6:8.2f} MB  {elapsed:7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Solver benchmark suite: synthetic cohorts swept over size, option count and
+preference distribution, timed per solver backend.
+
+Generators:
+    uniform    every student ranks options chosen uniformly at random
+    zipf       option popularity follows a Zipf law (a few options everyone wants)
+    clustered  students fall into interest groups that mostly rank their group's options
+    partial    like uniform, but students rank between 0 and --ranks options
+Capacity regimes:
+    tight      total seats equal the number of students
+    slack      50% more seats than students
+
+For every scenario each backend is timed (best of --repeat), then run once more
+under tracemalloc for peak memory. The problem size the backend works on is
+reported as "matrix": students x seats cells for hungarian, ranked seat edges for
+sparse, students x (options + 1) cells for flow. Backends whose problem would
+exceed --max-dense-cells / --max-sparse-edges are skipped instead of exhausting
+memory. The total cost is recorded too, so backends can be checked against each
+other and result quality compared across commits.
+
+Results are written as JSON. Passing an earlier file to --compare prints the time
+ratio of every scenario present in both.
+
+Run from the backend directory:
+    python -m benchmarks.bench_solver --output solver.json
+    python -m benchmarks.bench_solver --students 100 1000 --options 5 50 --compare solver.json
+"""
+import argparse
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from app import algorithm
+
+GENERATORS = ("uniform", "zipf", "clustered", "partial")
+CAPACITY_FACTORS = {"tight": 1.0, "slack": 1.5}
+SOLVERS = ("hungarian", "sparse", "flow", "auto")
+
+ZIPF_EXPONENT = 1.1
+CLUSTERS = 8
+IN_CLUSTER_WEIGHT = 8.0 # How much more likely a student ranks an option of their own group
+ROW_CHUNK = 2048 # Students per block when drawing rankings, bounds generator memory
+
+
+def _top_k(rng, log_weights, k):
+    """
+    Draws k distinct options per row, each pick proportional to exp(log_weights),
+    ordered best first (Gumbel top-k sampling).
+    """
+    keys = log_weights - np.log(-np.log(rng.random(log_weights.shape)))
+    top = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def generate(name, num_students, num_options, ranks, capacity_factor, seed=0):
+    """
+    Returns (capacities, student_idx, option_idx, rank) for a synthetic cohort, in the
+    array form taken by algorithm.solve_assignment_arrays.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(ranks, num_options)
+
+    if name == "zipf":
+        popularity = np.log(1.0 / np.arange(1, num_options + 1) ** ZIPF_EXPONENT)
+        popularity = popularity[rng.permutation(num_options)]
+    else:
+        popularity = np.zeros(num_options)
+    option_cluster = rng.integers(0, CLUSTERS, num_options)
+    student_cluster = rng.integers(0, CLUSTERS, num_students)
+
+    student_blocks, option_blocks, rank_blocks = [], [], []
+    for start in range(0, num_students, ROW_CHUNK):
+        rows = np.arange(start, min(start + ROW_CHUNK, num_students))
+        log_weights = np.broadcast_to(popularity, (rows.size, num_options))
+        if name == "clustered":
+            same = student_cluster[rows, None] == option_cluster[None, :]
+            log_weights = np.where(same, math.log(IN_CLUSTER_WEIGHT), 0.0)
+        chosen = _top_k(rng, log_weights, k)
+
+        counts = np.full(rows.size, k)
+        if name == "partial":
+            counts = rng.integers(0, k + 1, rows.size)
+        keep = np.arange(k)[None, :] < counts[:, None]
+        student_blocks.append(np.repeat(rows, counts))
+        option_blocks.append(chosen[keep])
+        rank_blocks.append(np.broadcast_to(np.arange(1, k + 1), chosen.shape)[keep])
+
+    # Seats spread unevenly over the options, summing to about capacity_factor x students
+    shares = rng.uniform(0.5, 1.5, num_options)
+    capacities = np.maximum(1, np.round(shares / shares.sum() * capacity_factor * num_students)).astype(np.int64)
+
+    return (
+        capacities,
+        np.concatenate(student_blocks).astype(np.int64),
+        np.concatenate(option_blocks).astype(np.int64),
+        np.concatenate(rank_blocks).astype(np.int64),
+    )
+
+
+def problem_size(backend, num_students, capacities, option_idx):
+    if backend == "hungarian":
+        return num_students * int(capacities.sum())
+    if backend == "sparse":
+        return int(np.minimum(capacities[option_idx], num_students).sum()) + num_students
+    return num_students * (len(capacities) + 1)
+
+
+def total_cost(assigned, student_idx, option_idx, rank):
+    """Objective value of an assignment, in the cost units of the solver."""
+    ranked = np.full(len(assigned), algorithm.UNRANKED_COST, dtype=np.int64)
+    match = assigned[student_idx] == option_idx
+    ranked[student_idx[match]] = rank[match]
+    ranked[assigned < 0] = algorithm.UNASSIGNED_COST
+    return int(ranked.sum()), float((ranked == 1).mean()), int((assigned < 0).sum())
+
+
+def run_scenario(args, generator, regime, num_students, num_options):
+    capacities, student_idx, option_idx, rank = generate(
+        generator, num_students, num_options, args.ranks, CAPACITY_FACTORS[regime], args.seed
+    )
+    auto_choice = algorithm.select_backend(num_students, capacities, capacities[option_idx])
+    limits = {"hungarian": args.max_dense_cells, "sparse": args.max_sparse_edges}
+
+    results = []
+    for backend in args.backends:
+        solver = auto_choice if backend == "auto" else backend
+        size = problem_size(solver, num_students, capacities, option_idx)
+        record = {
+            "generator": generator,
+            "capacity": regime,
+            "students": num_students,
+            "options": num_options,
+            "backend": backend,
+            "solver": solver,
+            "matrix": size,
+            "preferences": int(rank.size),
+        }
+        if size > limits.get(solver, size):
+            record["skipped"] = "problem too large for this backend"
+            results.append(record)
+            continue
+
+        best = math.inf
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            assigned = algorithm.solve_assignment_arrays(num_students, capacities, student_idx, option_idx, rank, backend)
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        algorithm.solve_assignment_arrays(num_students, capacities, student_idx, option_idx, rank, backend)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        cost, first_choice, unassigned = total_cost(assigned, student_idx, option_idx, rank)
+        record.update({
+            "seconds": round(best, 6),
+            "peak_mb": round(peak / 1e6, 3),
+            "cost": cost,
+            "first_choice_share": round(first_choice, 4),
+            "unassigned": unassigned,
+        })
+        results.append(record)
+    return results
+
+
+def scenario_key(record):
+    return (record["generator"], record["capacity"], record["students"], record["options"], record["backend"])
+
+
+def compare(results, path):
+    with open(path) as f:
+        previous = {scenario_key(r): r for r in json.load(f)["results"] if "seconds" in r}
+    print(f"\nCompared with {path} (new / old time):")
+    for record in results:
+        old = previous.get(scenario_key(record))
+        if old is None or "seconds" not in record:
+            continue
+        ratio = record["seconds"] / max(old["seconds"], 1e-9)
+        # Sub-millisecond scenarios jitter by more than 20%, only flag real slowdowns
+        flag = "  SLOWER" if ratio > 1.2 and record["seconds"] - old["seconds"] > 0.005 else ""
+        cost = "" if old["cost"] == record["cost"] else f"  cost {old['cost']} -> {record['cost']}"
+        print(f"  {'/'.join(map(str, scenario_key(record))):<40} {ratio:6.2f}x{flag}{cost}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--options", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--generators", nargs="+", choices=GENERATORS, default=list(GENERATORS))
+    parser.add_argument("--capacity", nargs="+", choices=list(CAPACITY_FACTORS), default=list(CAPACITY_FACTORS))
+    parser.add_argument("--backends", nargs="+", choices=SOLVERS, default=list(SOLVERS))
+    parser.add_argument("--ranks", type=int, default=5, help="options ranked per student")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per scenario, the best one counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-dense-cells", type=int, default=4 * algorithm.DENSE_CELL_LIMIT)
+    parser.add_argument("--max-sparse-edges", type=int, default=2 * algorithm.SPARSE_EDGE_LIMIT)
+    parser.add_argument("--output", default="bench_solver.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for generator in args.generators:
+        for regime in args.capacity:
+            for num_students in args.students:
+                for num_options in args.options:
+                    for record in run_scenario(args, generator, regime, num_students, num_options):
+                        results.append(record)
+                        label = f"{generator:<9} {regime:<5} {num_students:>6} x {num_options:<4} {record['backend']:<9}"
+                        if "skipped" in record:
+                            print(f"{label} skipped ({record['matrix']:,} > limit)")
+                        else:
+                            print(f"{label} {record['seconds']:9.4f}s  peak {record['peak_mb']:9.2f} MB  "
+                                  f"matrix {record['matrix']:>13,}  cost {record['cost']}")
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "arguments": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+End-to-end HTTP load test of app.main:app.
+
+Starts uvicorn in a subprocess against a fresh database in a temporary directory,
+registers an admin and creates projects through the API, submits --seed-students
+per project and calculates the results, so the admin views have data. Then runs
+concurrent virtual users for --duration seconds:
+    students  validate -> options -> submit, every iteration as a new student
+    admins    project list -> results -> CSV export of one of their projects
+Each virtual user has its own httpx client (and cookie jar) and goes through its
+flow back to back, or with --think-ms between requests. Every request is timed and
+reported per endpoint: requests, errors, error rate, throughput and p50/p95/p99/max
+latency. Any status of 400 or above, a timeout or a dropped connection counts as an
+error.
+
+Nothing external is needed: the database is SQLite in the temporary directory unless
+--database-url points at another one (a local PostgreSQL, say), which must be empty.
+The client runs in this one process, so at very high request rates it can become
+the bottleneck itself: the report shows its CPU time as a share of one core, and
+numbers taken while it is near 100% (or with client and server sharing few cores)
+understate the server.
+
+Run from the backend directory:
+    python -m benchmarks.load_http --workers 2 --students 50 --admins 5 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_EMAIL = "loadtest@example.com"
+ADMIN_PASSWORD = "load-test-password"
+REGISTER_SECRET = "load-test"
+
+
+class Recorder:
+    """Latencies (seconds) and status codes per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    async def request(self, client, endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.statuses[endpoint][status] += 1
+        if response is None or response.status_code >= 400:
+            self.errors[endpoint] += 1
+        return response
+
+    def report(self, elapsed):
+        def pick(ordered, q):
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+        report = {}
+        for endpoint, samples in self.latencies.items():
+            ordered = sorted(samples)
+            report[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors[endpoint],
+                "error_rate": round(self.errors[endpoint] / len(samples), 4),
+                "throughput_per_s": round(len(samples) / elapsed, 1),
+                "p50_ms": pick(ordered, 0.5),
+                "p95_ms": pick(ordered, 0.95),
+                "p99_ms": pick(ordered, 0.99),
+                "max_ms": pick(ordered, 1.0),
+                "statuses": {str(status): count for status, count in self.statuses[endpoint].items()},
+            }
+        return report
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, directory, port):
+    env = dict(
+        os.environ,
+        SECRET_KEY="load-test-secret",
+        REGISTER_SECRET=REGISTER_SECRET,
+        PASSWORD_PEPPER="load-test-pepper",
+        DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(directory, 'group_assignment.db')}",
+        INGEST_LOG_DIR=os.path.join(directory, "ingest"),
+        INGEST_BUFFER=str(args.ingest_buffer),
+    )
+    log = open(os.path.join(directory, "server.log"), "wb")
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(args.workers), "--no-access-log", "--log-level", "warning",
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT), log.name
+
+
+async def wait_until_ready(base_url, server, log_path, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                break
+            try:
+                await client.get("/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    with open(log_path) as f:
+        sys.exit(f"Server did not start, its log:\n{f.read()[-4000:]}")
+
+
+async def student_flow(client, recorder, code, student_number, option_ids, think):
+    """One student: validate, load the options and submit a ranking. Stops at the first failure."""
+    response = await recorder.request(client, "GET /students/validate", "GET", f"/api/students/validate/{code}/{student_number}")
+    if response is None or response.status_code != 200:
+        return
+    await asyncio.sleep(think)
+    response = await recorder.request(client, "GET /students/options", "GET", f"/api/students/options/{code}")
+    if response is None or response.status_code != 200:
+        return
+    await asyncio.sleep(think)
+    offset = hash(student_number) % len(option_ids)
+    ranked = (option_ids[offset:] + option_ids[:offset])[:5]
+    await recorder.request(client, "POST /students/submit", "POST", "/api/students/submit", json={
+        "project_code": code,
+        "student_id": student_number,
+        "preferences": [{"option_id": option_id, "rank": rank} for rank, option_id in enumerate(ranked, start=1)],
+    })
+
+
+async def admin_flow(client, recorder, project_id, think):
+    await recorder.request(client, "GET /projects", "GET", "/api/projects/")
+    await asyncio.sleep(think)
+    await recorder.request(client, "GET /projects/results", "GET", f"/api/projects/{project_id}/results")
+    await asyncio.sleep(think)
+    await recorder.request(client, "GET /projects/export", "GET", f"/api/projects/{project_id}/export", params={"format": "csv"})
+
+
+async def seed(base_url, args):
+    """Admin, projects and initial submissions with calculated results. Returns (token, projects)."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        response = await client.post("/api/admin/register", json={
+            "name": "Load", "sirname": "Test", "department": "Benchmarks",
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD, "register_code": REGISTER_SECRET,
+        })
+        response.raise_for_status()
+        response = await client.post("/api/admin/login", data={"username": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        projects = []
+        for p in range(args.projects):
+            response = await client.post("/api/projects/", headers=headers, json={
+                "title": f"Load test {p}",
+                "options": [
+                    {"title": f"Option {j}", "description": "", "capacity": args.capacity}
+                    for j in range(args.options)
+                ],
+            })
+            response.raise_for_status()
+            project = response.json()
+            (await client.put(f"/api/projects/{project['id']}/finalise", headers=headers)).raise_for_status()
+            projects.append((project["id"], project["unique_code"], [o["id"] for o in project["options"]]))
+
+    # Seed submissions go through the same flow, untimed, a few students at a time
+    recorder = Recorder()
+    for project_id, code, option_ids in projects:
+        async def seed_students(worker):
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+                for n in range(worker, args.seed_students, 8):
+                    await student_flow(client, recorder, code, f"seed{project_id}-{n:06d}", option_ids, 0)
+        await asyncio.gather(*(seed_students(worker) for worker in range(8)))
+    failed = sum(recorder.errors.values())
+    if failed:
+        sys.exit(f"Seeding failed with {failed} errors: {dict(recorder.statuses)}")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, headers=headers) as client:
+        for project_id, _, _ in projects:
+            (await client.post(f"/api/projects/{project_id}/calculate")).raise_for_status()
+    return token, projects
+
+
+async def run(args):
+    directory = tempfile.mkdtemp(prefix="load_http_")
+    port = free_port()
+    base_url = f"http://localhost:{port}"
+    server, log_path = start_server(args, directory, port)
+    try:
+        await wait_until_ready(base_url, server, log_path)
+        token, projects = await seed(base_url, args)
+        print(f"Server: {args.workers} worker(s), data in {directory}; "
+              f"{len(projects)} projects seeded with {args.seed_students} students each")
+
+        recorder = Recorder()
+        think = args.think_ms / 1000
+        deadline = time.perf_counter() + args.duration
+        # Slow responses are kept (and counted) instead of being cut off by the client
+        limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+
+        async def student_user(user):
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+                iteration = 0
+                while time.perf_counter() < deadline:
+                    project_id, code, option_ids = projects[(user + iteration) % len(projects)]
+                    await student_flow(client, recorder, code, f"u{user:04d}-{iteration:07d}", option_ids, think)
+                    iteration += 1
+
+        async def admin_user(user):
+            headers = {"Authorization": f"Bearer {token}"}
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits, headers=headers) as client:
+                iteration = 0
+                while time.perf_counter() < deadline:
+                    await admin_flow(client, recorder, projects[(user + iteration) % len(projects)][0], think)
+                    iteration += 1
+
+        start, client_cpu = time.perf_counter(), time.process_time()
+        await asyncio.gather(
+            *(student_user(user) for user in range(args.students)),
+            *(admin_user(user) for user in range(args.admins)),
+        )
+        elapsed = time.perf_counter() - start
+        client_cpu = (time.process_time() - client_cpu) / elapsed
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    report = recorder.report(elapsed)
+    total = sum(r["requests"] for r in report.values())
+    errors = sum(r["errors"] for r in report.values())
+    print(f"{args.students} students, {args.admins} admins for {elapsed:.1f}s: "
+          f"{total} requests ({total / elapsed:.1f}/s), {errors} errors, "
+          f"client CPU {client_cpu:.0%} of a core ({os.cpu_count()} cores)\n")
+    print(f"{'endpoint':<26}{'requests':>9}{'req/s':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, r in report.items():
+        print(f"{endpoint:<26}{r['requests']:>9}{r['throughput_per_s']:>9}{r['error_rate']:>8.1%}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+        if r["errors"]:
+            print(f"{'':<26}statuses: {r['statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "arguments": vars(args),
+                "seconds": round(elapsed, 3),
+                "client_cpu": round(client_cpu, 3),
+                "cpu_count": os.cpu_count(),
+                "endpoints": report,
+            }, f, indent=1)
+        print(f"\nWrote {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--students", type=int, default=50, help="concurrent student virtual users")
+    parser.add_argument("--admins", type=int, default=5, help="concurrent admin virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between the requests of a flow")
+    parser.add_argument("--projects", type=int, default=4)
+    parser.add_argument("--options", type=int, default=20, help="options per project")
+    parser.add_argument("--capacity", type=int, default=100, help="seats per option")
+    parser.add_argument("--seed-students", type=int, default=200, help="submissions per project before the run")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request counts as failed")
+    parser.add_argument("--database-url", help="empty database to use instead of a temporary SQLite file")
+    parser.add_argument("--ingest-buffer", action="store_true", help="run the server with INGEST_BUFFER on")
+    parser.add_argument("--output", help="write the report as JSON")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Load test for the student submit path against SQLite.
+
+"before" runs the original sync submit path (student commit, refresh, one ORM insert
+per preference, second commit) on a bare engine (default rollback journal, no
+pragmas) with unserialized writes. "tuned" runs the same path on the tuned engine
+from app.database (WAL, synchronous=NORMAL, busy timeout, mmap/cache size) with the
+write lock. "async" awaits the current submit_choices endpoint: one transaction with
+a bulk preference insert on the async engine. "buffered" runs the same endpoint with
+the write-behind ingest buffer and stops the clock once everything is committed.
+Several processes with several threads (or concurrent tasks for "async" and
+"buffered") each submit directly, like uvicorn workers would.
+
+Run from the backend directory:
+    python -m benchmarks.load_submissions --processes 4 --threads 8 --per-thread 100
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("REGISTER_SECRET", "benchmark")
+os.environ.setdefault("PASSWORD_PEPPER", "benchmark")
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app import database, models, schemas, jobs, ingest
+from app.config import settings
+from app.routers import students
+
+PROJECT_CODE = "loadtest"
+NUM_OPTIONS = 20
+
+
+def setup_database(url: str, tuned: bool):
+    engine = database.create_db_engine(url, tuned=tuned)
+    database.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    project = models.Project(title="Load test", unique_code=PROJECT_CODE, is_active=True, is_closed=False)
+    db.add(project)
+    db.flush()
+    db.add_all([
+        models.Option(project_id=project.id, title=f"Option {j}", description="", capacity=50)
+        for j in range(NUM_OPTIONS)
+    ])
+    db.commit()
+    option_ids = [o.id for o in db.query(models.Option).all()]
+    db.close()
+    engine.dispose()
+    return option_ids
+
+
+def make_submission(student_number, n, option_ids):
+    return schemas.StudentSubmission(
+        project_code=PROJECT_CODE,
+        student_id=student_number,
+        preferences=[
+            schemas.PreferenceItem(option_id=option_ids[(n + k) % len(option_ids)], rank=k + 1)
+            for k in range(5)
+        ],
+    )
+
+
+def sync_submit(submission, db):
+    """The submit path before it moved to the async engine, kept for comparison."""
+    project = db.query(models.Project).filter(models.Project.unique_code == submission.project_code).first()
+    if not project or not project.is_active or project.is_closed:
+        raise HTTPException(status_code=400, detail="Invalid project state")
+    existing_student = db.query(models.Student).filter(
+        models.Student.student_number == submission.student_id,
+        models.Student.project_id == project.id
+    ).first()
+    if existing_student:
+        raise HTTPException(status_code=409, detail="Duplicate")
+
+    with database.write_lock(db.get_bind()):
+        student = models.Student(project_id=project.id, student_number=submission.student_id)
+        db.add(student)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Duplicate")
+        db.refresh(student)
+        for pref in submission.preferences:
+            db.add(models.Preference(student_id=student.id, option_id=pref.option_id, rank=pref.rank))
+        jobs.bump_revision(db, project.id)
+        db.commit()
+
+
+def run_sync_worker(url, tuned, worker, threads, per_thread, option_ids):
+    settings.SQLITE_SERIALIZE_WRITES = tuned
+    engine = database.create_db_engine(url, tuned=tuned)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def submit(thread):
+        ok = errors = 0
+        for n in range(per_thread):
+            submission = make_submission(f"i{worker:02d}{thread:03d}{n:05d}", n, option_ids)
+            db = Session()
+            try:
+                sync_submit(submission, db)
+                ok += 1
+            except (OperationalError, HTTPException):
+                errors += 1
+            finally:
+                db.close()
+        return ok, errors
+
+    # Wall-clock bounds exclude process start-up and imports
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(submit, range(threads)))
+    end = time.time()
+    engine.dispose()
+    return sum(r[0] for r in results), sum(r[1] for r in results), start, end
+
+
+def run_async_worker(url, tuned, worker, tasks, per_task, option_ids, buffered=False):
+    settings.SQLITE_SERIALIZE_WRITES = tuned
+    settings.INGEST_BUFFER = buffered
+    if buffered:
+        log_dir = os.path.join(os.path.dirname(make_url(url).database), "ingest")
+        ingest.buffer = ingest.SubmissionBuffer(
+            database.create_db_engine(url, tuned=tuned), log_dir,
+            settings.INGEST_BATCH_SIZE, settings.INGEST_FLUSH_INTERVAL_MS / 1000,
+        )
+        ingest.buffer.start()
+
+    async def run():
+        engine = database.create_async_db_engine(url, tuned=tuned)
+        Session = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def submit(task):
+            ok = errors = 0
+            for n in range(per_task):
+                student_number = f"i{worker:02d}{task:03d}{n:05d}"
+                submission = make_submission(student_number, n, option_ids)
+                async with Session() as db:
+                    try:
+                        await students.submit_choices(submission, db, {"student_number": student_number, "unique_code": PROJECT_CODE})
+                        ok += 1
+                    except (OperationalError, HTTPException):
+                        errors += 1
+            return ok, errors
+
+        start = time.time()
+        results = await asyncio.gather(*(submit(task) for task in range(tasks)))
+        if buffered:
+            # Count a submission once it is committed, not when it was acknowledged
+            await asyncio.to_thread(ingest.buffer.drain)
+        end = time.time()
+        await engine.dispose()
+        return sum(r[0] for r in results), sum(r[1] for r in results), start, end
+
+    try:
+        return asyncio.run(run())
+    finally:
+        if buffered:
+            ingest.buffer.stop()
+
+
+def run_buffered_worker(url, tuned, worker, tasks, per_task, option_ids):
+    return run_async_worker(url, tuned, worker, tasks, per_task, option_ids, buffered=True)
+
+
+def run_mode(name, worker, tuned, args):
+    directory = tempfile.mkdtemp(prefix=f"loadtest_{name}_")
+    url = f"sqlite:///{os.path.join(directory, 'group_assignment.db')}"
+    option_ids = setup_database(url, tuned)
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.processes) as pool:
+        results = pool.starmap(
+            worker,
+            [(url, tuned, w, args.threads, args.per_thread, option_ids) for w in range(args.processes)],
+        )
+    elapsed = max(r[3] for r in results) - min(r[2] for r in results)
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    print(f"{name:>8}: {ok:>6} ok {errors:>6} failed in {elapsed:7.2f}s -> {ok / elapsed:8.1f} submissions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--per-thread", type=int, default=100)
+    args = parser.parse_args()
+
+    run_mode("before", run_sync_worker, False, args)
+    run_mode("tuned", run_sync_worker, True, args)
+    run_mode("async", run_async_worker, True, args)
+    run_mode("buffered", run_buffered_worker, True, args)
+
+
+if __name__ == "__main__":
+    main()
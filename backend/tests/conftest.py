@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The app reads its settings at import time; tests run against a throwaway SQLite file
+_directory = tempfile.mkdtemp(prefix="group_assignment_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_directory}/test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-0123456789abcdef")
+os.environ.setdefault("REGISTER_SECRET", "test-register-secret")
+os.environ.setdefault("PASSWORD_PEPPER", "test-password-pepper-0123456789")
+os.environ.setdefault("INGEST_LOG_DIR", os.path.join(_directory, "ingest"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
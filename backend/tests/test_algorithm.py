@@ -0,0 +1,208 @@
+import math
+import random
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, linear_sum_assignment, milp
+from app import algorithm
+
+
+def total_cost(num_students, num_options, student_idx, option_idx, rank, assigned):
+    cost = algorithm._flow_cost(num_students, num_options, student_idx, option_idx, rank)
+    return int(cost[np.arange(num_students), np.where(assigned < 0, num_options, assigned)].sum())
+
+
+def random_instance(rng, max_students, max_options, max_capacity):
+    num_students, num_options = rng.randint(1, max_students), rng.randint(1, max_options)
+    capacities = np.array([rng.randint(0, max_capacity) for _ in range(num_options)], dtype=np.int64)
+    student_idx, option_idx, rank = [], [], []
+    for i in range(num_students):
+        for r, j in enumerate(rng.sample(range(num_options), rng.randint(0, num_options)), start=1):
+            student_idx.append(i)
+            option_idx.append(j)
+            rank.append(r)
+    arrays = (np.array(a, dtype=np.int64) for a in (student_idx, option_idx, rank))
+    return (num_students, capacities, *arrays)
+
+
+def exact_bounded_cost(num_students, capacities, minimums, student_idx, option_idx, rank):
+    """Optimal total cost with minimums, as an integer program: x per (student, option or no seat), y per option."""
+    num_options = len(capacities)
+    cost = algorithm._flow_cost(num_students, num_options, student_idx, option_idx, rank)
+    width = num_options + 1
+    num_x = num_students * width
+    constraints = []
+
+    def constrain(columns, weights, lower, upper):
+        row = np.zeros(num_x + num_options)
+        row[columns] = weights
+        constraints.append(LinearConstraint(row, lower, upper))
+
+    for i in range(num_students):
+        constrain(slice(i * width, (i + 1) * width), 1, 1, 1)
+    for j in range(num_options):
+        seats = [i * width + j for i in range(num_students)] + [num_x + j]
+        constrain(seats, [1] * num_students + [-capacities[j]], -np.inf, 0)
+        constrain(seats, [1] * num_students + [-minimums[j]], 0, np.inf)
+    result = milp(
+        np.concatenate([cost.ravel(), np.zeros(num_options)]),
+        constraints=constraints,
+        integrality=np.ones(num_x + num_options), bounds=Bounds(0, 1),
+    )
+    return round(result.fun)
+
+
+def test_minimums_reopen_an_option_to_seat_everyone():
+    options = [
+        {"id": 10, "capacity": 2, "min_capacity": 0},
+        {"id": 11, "capacity": 4, "min_capacity": 4},
+        {"id": 12, "capacity": 3, "min_capacity": 3},
+    ]
+    students = [
+        {"id": 0, "preferences": {12: 1, 10: 2}},
+        {"id": 1, "preferences": {10: 1, 11: 2}},
+        {"id": 2, "preferences": {}},
+        {"id": 3, "preferences": {12: 1, 10: 2, 11: 3}},
+        {"id": 4, "preferences": {10: 1}},
+        {"id": 5, "preferences": {10: 1, 11: 2}},
+    ]
+    result = algorithm.solve_assignment(students, options)
+    assert sorted(result) == [0, 1, 2, 3, 4, 5]
+    assert sorted(result.values()).count(11) == 4 and 12 not in result.values()
+    ranks = [students[sid]["preferences"].get(oid, algorithm.UNRANKED_COST) for sid, oid in result.items()]
+    assert sum(ranks) == 1010
+
+
+def test_minimums_match_exact_solution():
+    rng = random.Random(21)
+    for _ in range(300):
+        num_students, capacities, student_idx, option_idx, rank = random_instance(rng, 9, 5, 5)
+        minimums = np.array([rng.choice([0, 0, rng.randint(1, 5)]) for _ in capacities], dtype=np.int64)
+        minimums = np.minimum(minimums, capacities)
+        assigned = algorithm.solve_assignment_arrays(
+            num_students, capacities, student_idx, option_idx, rank, "auto", minimums
+        )
+        load = np.bincount(assigned[assigned >= 0], minlength=len(capacities))
+        assert np.all((load == 0) | ((load >= minimums) & (load <= capacities)))
+        expected = exact_bounded_cost(num_students, capacities, minimums, student_idx, option_idx, rank)
+        assert total_cost(num_students, len(capacities), student_idx, option_idx, rank, assigned) == expected
+
+
+def test_backends_agree_on_total_cost():
+    rng = random.Random(1)
+    for _ in range(300):
+        # Capacities start at 0 (closed options), and seats often run out
+        num_students, capacities, student_idx, option_idx, rank = random_instance(rng, 12, 6, 4)
+        totals = set()
+        for backend in ("hungarian", "sparse", "flow"):
+            assigned = algorithm.solve_assignment_arrays(num_students, capacities, student_idx, option_idx, rank, backend)
+            load = np.bincount(assigned[assigned >= 0], minlength=len(capacities))
+            assert np.all(load <= capacities), backend
+            assert (assigned >= 0).sum() == min(num_students, capacities.sum()), backend
+            totals.add(total_cost(num_students, len(capacities), student_idx, option_idx, rank, assigned))
+        assert len(totals) == 1
+
+
+
+def test_backends_agree_on_ranks_below_one():
+    # The API rejects them, but the solvers take any rank
+    rng = random.Random(2)
+    for _ in range(200):
+        num_students, capacities, student_idx, option_idx, rank = random_instance(rng, 8, 4, 3)
+        rank = rank - 2
+        totals = {
+            total_cost(num_students, len(capacities), student_idx, option_idx, rank,
+                       algorithm.solve_assignment_arrays(num_students, capacities, student_idx, option_idx, rank, backend))
+            for backend in ("hungarian", "sparse", "flow")
+        }
+        assert len(totals) == 1
+
+
+def random_preferences(rng, option_ids):
+    return {option_id: r for r, option_id in enumerate(rng.sample(option_ids, rng.randint(0, len(option_ids))), start=1)}
+
+
+def test_incremental_repair_matches_full_solve():
+    rng = random.Random(6)
+    for _ in range(40):
+        options = [{"id": 100 + j, "capacity": rng.randint(0, 8)} for j in range(rng.randint(2, 6))]
+        option_ids = [opt["id"] for opt in options]
+        students = [{"id": i, "preferences": random_preferences(rng, option_ids)} for i in range(rng.randint(30, 60))]
+        next_id = len(students)
+        _, state = algorithm.solve_assignment_incremental(students, options)
+        for _ in range(10):
+            # Few enough changes to stay under INCREMENTAL_CHANGE_DIVISOR (an edit counts twice)
+            for _ in range(rng.randint(1, max(1, len(students) // algorithm.INCREMENTAL_CHANGE_DIVISOR // 2))):
+                change = rng.choice(("add", "edit", "delete"))
+                if change == "add":
+                    students.append({"id": next_id, "preferences": random_preferences(rng, option_ids)})
+                    next_id += 1
+                elif change == "edit":
+                    rng.choice(students)["preferences"] = random_preferences(rng, option_ids)
+                else:
+                    students.pop(rng.randrange(len(students)))
+            result, state = algorithm.solve_assignment_incremental(students, options, state)
+            assert state["potential"] is not None # Repaired, not solved again
+
+            def cost_of(assignments):
+                return sum(
+                    s["preferences"].get(assignments[s["id"]], algorithm.UNRANKED_COST) if s["id"] in assignments
+                    else algorithm.UNASSIGNED_COST
+                    for s in students
+                )
+
+            loads = {option_id: list(result.values()).count(option_id) for option_id in option_ids}
+            assert all(loads[opt["id"]] <= opt["capacity"] for opt in options)
+            assert set(result) <= {s["id"] for s in students}
+            assert cost_of(result) == cost_of(algorithm.solve_assignment(students, options))
+
+
+def seated_ranks(student_idx, option_idx, rank, assigned):
+    """Rank every seated student got, UNRANKED_COST for an unranked seat."""
+    ranks = np.full(len(assigned), algorithm.UNRANKED_COST, dtype=np.int64)
+    match = assigned[student_idx] == option_idx
+    ranks[student_idx[match]] = rank[match]
+    return ranks[assigned >= 0]
+
+
+def best_seating(num_students, capacities, student_idx, option_idx, rank, seat_cost):
+    """Lowest total of seat_cost(rank) over seatings that fill min(students, seats) seats, by brute-force Hungarian."""
+    ranks = np.full((num_students, len(capacities)), algorithm.UNRANKED_COST, dtype=np.int64)
+    ranks[student_idx, option_idx] = rank
+    cost = np.vectorize(seat_cost, otypes=[float])(ranks[:, np.repeat(np.arange(len(capacities)), capacities)])
+    try:
+        rows, cols = linear_sum_assignment(cost)
+    except ValueError:  # Every seating takes a forbidden (infinite) seat
+        return math.inf
+    return cost[rows, cols].sum()
+
+
+def test_objectives_match_brute_force():
+    rng = random.Random(22)
+    for _ in range(300):
+        num_students, capacities, student_idx, option_idx, rank = random_instance(rng, 8, 5, 3)
+        arrays = (num_students, capacities, student_idx, option_idx, rank)
+        if min(num_students, capacities.sum()) == 0:
+            continue
+        levels = list(range(1, len(capacities) + 1)) + [algorithm.UNRANKED_COST]
+
+        # rank_maximal: weights growing faster than any number of students make the
+        # Hungarian solve maximise first choices, then second choices and so on
+        assigned = algorithm.solve_assignment_arrays(*arrays, objective="rank_maximal")
+        weight = {level: -float(num_students + 1) ** (len(levels) - k) for k, level in enumerate(levels)}
+        got = seated_ranks(student_idx, option_idx, rank, assigned)
+        assert len(got) == min(num_students, capacities.sum())
+        assert sum(weight[r] for r in got) == best_seating(*arrays, weight.get)
+
+        # min_worst_rank: the lowest rank cap that still fills the seats, then the lowest sum under it
+        worst = next(
+            (w for w in levels[:-1] if best_seating(*arrays, lambda r: r if r <= w else math.inf) < math.inf), None
+        )
+        for backend in ("hungarian", "sparse", "flow"):
+            assigned = algorithm.solve_assignment_arrays(*arrays, backend, objective="min_worst_rank")
+            got = seated_ranks(student_idx, option_idx, rank, assigned)
+            assert len(got) == min(num_students, capacities.sum()), backend
+            if worst is None:
+                assert got.max() == algorithm.UNRANKED_COST, backend
+                assert got.sum() == best_seating(*arrays, lambda r: r), backend
+            else:
+                assert got.max() == worst, backend
+                assert got.sum() == best_seating(*arrays, lambda r: r if r <= worst else math.inf), backend
@@ -0,0 +1,62 @@
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from app import auth, database, models
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app, base_url="http://localhost") as client:
+        yield client
+
+
+@pytest.fixture
+def project():
+    """A project with two options, and the headers of its admin."""
+    db = database.SessionLocal()
+    try:
+        admin = models.Admin(email=f"{uuid.uuid4().hex}@example.edu", hashed_password="unused")
+        db.add(admin)
+        db.flush()
+        project = models.Project(title="Import", unique_code=uuid.uuid4().hex[:12], owner_id=admin.id)
+        db.add(project)
+        db.flush()
+        options = [models.Option(project_id=project.id, title=f"Option {o}", description="", capacity=2) for o in range(2)]
+        db.add_all(options)
+        db.commit()
+        headers = {"Authorization": f"Bearer {auth.create_admin_token(admin)}"}
+        return project.id, [option.id for option in options], headers
+    finally:
+        db.close()
+
+
+def upload(client, project_id, headers, text):
+    files = {"file": ("preferences.csv", text.encode(), "text/csv")}
+    return client.post(f"/api/projects/{project_id}/bulk-import", files=files, headers=headers)
+
+
+def student_count():
+    with database.SessionLocal() as db:
+        return db.execute(select(func.count()).select_from(models.Student)).scalar_one()
+
+
+def test_empty_file_is_rejected(client, project):
+    project_id, _, headers = project
+    before = student_count()
+    response = upload(client, project_id, headers, "student_number,option_id,rank\n")
+    assert response.status_code == 400
+    assert student_count() == before
+
+
+def test_students_cannot_be_imported_twice(client, project):
+    project_id, (first, second), headers = project
+    text = f"student_number,option_id,rank\ns1,{first},1\ns1,{second},2\ns2,{second},1\n"
+    response = upload(client, project_id, headers, text)
+    assert response.status_code == 200
+    assert response.json() == {"status": "imported", "students": 2, "preferences": 3}
+
+    before = student_count()
+    assert upload(client, project_id, headers, f"student_number,option_id,rank\ns2,{first},1\n").status_code == 409
+    assert student_count() == before
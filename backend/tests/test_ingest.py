@@ -0,0 +1,141 @@
+import asyncio
+import fcntl
+import os
+import uuid
+from unittest import mock
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app import auth, database, ingest, models, schemas
+from app.routers import students
+from app.main import app
+
+OTHER_WORKER = 999_999_999 # A process id no real worker has
+
+
+@pytest.fixture
+def buffer(tmp_path):
+    buffer = ingest.SubmissionBuffer(database.engine, str(tmp_path), batch_size=500, flush_interval=0.02)
+    buffer.start()
+    with mock.patch.object(ingest, "buffer", buffer), mock.patch.object(auth.settings, "INGEST_BUFFER", True):
+        yield buffer
+    buffer.stop()
+
+
+@pytest.fixture
+def client(buffer):
+    with TestClient(app, base_url="http://localhost") as client:
+        yield client
+
+
+@pytest.fixture
+def project():
+    """An open project with one option: (id, unique code, option id, admin headers)."""
+    db = database.SessionLocal()
+    try:
+        admin = models.Admin(email=f"{uuid.uuid4().hex}@example.edu", hashed_password="unused")
+        db.add(admin)
+        db.flush()
+        project = models.Project(title="Ingest", unique_code=uuid.uuid4().hex[:12], owner_id=admin.id, is_active=True)
+        db.add(project)
+        db.flush()
+        option = models.Option(project_id=project.id, title="Option", description="", capacity=10)
+        db.add(option)
+        db.commit()
+        return project.id, project.unique_code, option.id, {"Authorization": f"Bearer {auth.create_admin_token(admin)}"}
+    finally:
+        db.close()
+
+
+def running_worker(buffer, project_id, student_number):
+    """Claim held by another worker, which counts as running while its log stays locked."""
+    log = open(os.path.join(buffer.log_dir, f"submissions-{OTHER_WORKER}.log"), "a")
+    fcntl.flock(log, fcntl.LOCK_EX)
+    path = buffer._claim_path(project_id, student_number)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(str(OTHER_WORKER))
+    return log
+
+
+def submit(client, unique_code, option_id, student_number, rank=1):
+    assert client.get(f"/api/students/validate/{unique_code}/{student_number}").status_code == 200
+    return client.post("/api/students/submit", json={
+        "project_code": unique_code,
+        "student_id": student_number,
+        "preferences": [{"option_id": option_id, "rank": rank}],
+    })
+
+
+def is_closed(project_id):
+    with database.SessionLocal() as db:
+        return db.get(models.Project, project_id).is_closed
+
+
+def test_claims_of_running_workers_are_waited_for(buffer):
+    log = running_worker(buffer, -1, "s1")
+    assert not buffer.reserve(-1, "s1")
+    assert not buffer.drain_project(-1, timeout=0.1)
+
+    # Once that worker stops, its claim is stale and given up
+    log.close()
+    assert buffer.drain_project(-1, timeout=1)
+    assert buffer.reserve(-1, "s1")
+    buffer.release(-1, "s1")
+    assert buffer.drain_project(-1, timeout=0)
+
+
+def test_close_waits_for_buffered_submissions(client, buffer, project):
+    project_id, unique_code, option_id, headers = project
+    assert submit(client, unique_code, option_id, "s1").status_code == 200
+
+    # Another worker still saving a submission keeps the close from finishing, so the form opens again
+    log = running_worker(buffer, project_id, "s2")
+    with mock.patch.object(auth.settings, "INGEST_CLOSE_TIMEOUT_SECONDS", 0.1):
+        assert client.put(f"/api/projects/{project_id}/close", headers=headers).status_code == 503
+    assert not is_closed(project_id)
+
+    log.close()
+    assert client.put(f"/api/projects/{project_id}/close", headers=headers).status_code == 200
+    assert is_closed(project_id)
+    with database.SessionLocal() as db:
+        stored = db.query(models.Student.student_number).filter(models.Student.project_id == project_id).all()
+    assert stored == [("s1",)]
+
+
+def test_submissions_that_reach_the_buffer_after_the_close_are_rejected(buffer, project):
+    project_id, unique_code, option_id, _ = project
+    with database.SessionLocal() as db:
+        db.get(models.Project, project_id).is_closed = True
+        db.commit()
+    submission = schemas.StudentSubmission(
+        project_code=unique_code, student_id="late", preferences=[{"option_id": option_id, "rank": 1}]
+    )
+
+    async def late_submission():
+        async with database.AsyncSessionLocal() as db:
+            await students.buffer_submission(submission, project_id, db)
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(late_submission())
+    assert rejected.value.status_code == 400
+    assert buffer.drain_project(project_id, timeout=0)
+
+
+def test_only_storable_submissions_are_acknowledged(client, buffer, project):
+    project_id, unique_code, option_id, headers = project
+    assert submit(client, unique_code, option_id + 1000, "s1").status_code == 400
+    assert submit(client, unique_code, option_id, "s1", rank=0).status_code == 422
+
+    # A student another worker is still saving is a duplicate here too
+    log = running_worker(buffer, project_id, "s2")
+    assert submit(client, unique_code, option_id, "s2").status_code == 409
+    log.close()
+
+    assert submit(client, unique_code, option_id, "s1").status_code == 200
+    assert buffer.drain_project(project_id, timeout=1)
+    with database.SessionLocal() as db:
+        stored = db.query(models.Preference.option_id, models.Preference.rank).join(models.Student).filter(
+            models.Student.project_id == project_id
+        ).all()
+    assert stored == [(option_id, 1)]
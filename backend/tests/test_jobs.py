@@ -0,0 +1,23 @@
+import asyncio
+from app import jobs
+
+
+def test_jobs_are_shared_per_project_and_objective():
+    async def submit_all():
+        manager = jobs.JobManager(max_workers=1)
+        try:
+            # The project does not exist, so every job fails while loading and no solve starts
+            first = manager.submit(-1, "sum")
+            other = manager.submit(-1, "rank_maximal")
+            again = manager.submit(-1, "sum")
+            assert again is first and other is not first
+            assert first.task is not None and not first.task.done()
+            await asyncio.gather(first.done.wait(), other.done.wait())
+            assert first.status == other.status == "failed"
+            last = manager.submit(-1, "sum")
+            assert last is not first # Finished jobs are not joined
+            await last.done.wait()
+        finally:
+            manager.shutdown()
+
+    asyncio.run(submit_all())
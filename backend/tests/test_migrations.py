@@ -0,0 +1,58 @@
+import uuid
+from unittest import mock
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select, text
+from app import auth, database, migrations, models
+from app.main import app
+
+_students = models.Student.__table__
+
+
+def test_duplicates_skip_the_unique_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {models.STUDENT_NUMBER_INDEX}"))
+        conn.execute(_students.insert(), [{"project_id": 1, "student_number": "s1"}] * 2)
+    with mock.patch.object(migrations, "skipped_indexes", set()):
+        migrations.run_migrations(engine)
+        assert migrations.skipped_indexes == {models.STUDENT_NUMBER_INDEX}
+
+
+@pytest.fixture
+def without_unique_index():
+    """The test database as an old one where the unique index could not be created."""
+    with database.engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {models.STUDENT_NUMBER_INDEX}"))
+    with mock.patch.object(migrations, "skipped_indexes", {models.STUDENT_NUMBER_INDEX}):
+        yield
+    with database.engine.begin() as conn:
+        next(i for i in _students.indexes if i.name == models.STUDENT_NUMBER_INDEX).create(bind=conn)
+
+
+def test_duplicates_are_looked_for_without_the_index(without_unique_index):
+    with database.SessionLocal() as db:
+        admin = models.Admin(email=f"{uuid.uuid4().hex}@example.edu", hashed_password="unused")
+        db.add(admin)
+        db.flush()
+        project = models.Project(title="Old", unique_code=uuid.uuid4().hex[:12], owner_id=admin.id, is_active=True)
+        db.add(project)
+        db.flush()
+        option = models.Option(project_id=project.id, title="Option", description="", capacity=5)
+        db.add(option)
+        db.commit()
+        project_id, unique_code, option_id = project.id, project.unique_code, option.id
+        headers = {"Authorization": f"Bearer {auth.create_admin_token(admin)}"}
+
+    with TestClient(app, base_url="http://localhost") as client:
+        assert client.get(f"/api/students/validate/{unique_code}/s1").status_code == 200
+        submission = {"project_code": unique_code, "student_id": "s1", "preferences": []}
+        assert client.post("/api/students/submit", json=submission).status_code == 200
+        assert client.post("/api/students/submit", json=submission).status_code == 409
+        files = {"file": ("preferences.csv", f"student_number,option_id,rank\ns1,{option_id},1\n".encode(), "text/csv")}
+        response = client.post(f"/api/projects/{project_id}/bulk-import", files=files, headers=headers)
+        assert response.status_code == 400 and "already submitted" in response.json()["detail"]
+    with database.SessionLocal() as db:
+        count = db.execute(select(func.count()).where(_students.c.project_id == project_id)).scalar_one()
+    assert count == 1
@@ -0,0 +1,70 @@
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app import auth, database, models
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app, base_url="http://localhost") as client:
+        yield client
+
+
+def seed(size: int):
+    """An admin with size projects, each with size options and size students who ranked and got them."""
+    db = database.SessionLocal()
+    try:
+        admin = models.Admin(email=f"{uuid.uuid4().hex}@example.edu", hashed_password="unused")
+        db.add(admin)
+        db.flush()
+        project_ids = []
+        for p in range(size):
+            project = models.Project(title=f"Project {p}", unique_code=uuid.uuid4().hex[:12], owner_id=admin.id)
+            db.add(project)
+            db.flush()
+            options = [
+                models.Option(project_id=project.id, title=f"Option {o}", description="", capacity=size)
+                for o in range(size)
+            ]
+            db.add_all(options)
+            db.flush()
+            for s in range(size):
+                student = models.Student(
+                    project_id=project.id, student_number=f"i{s}", assigned_option_id=options[s % size].id
+                )
+                student.preferences = [
+                    models.Preference(option_id=option.id, rank=rank) for rank, option in enumerate(options, start=1)
+                ]
+                db.add(student)
+            project_ids.append(project.id)
+        db.commit()
+        return auth.create_admin_token(admin), project_ids[0]
+    finally:
+        db.close()
+
+
+def statement_counts(client, token, project_id):
+    headers = {"Authorization": f"Bearer {token}"}
+    paths = ["/api/projects/", f"/api/projects/{project_id}/students", f"/api/projects/{project_id}/results"]
+    for path in paths: # The first request also caches the admin's token version
+        assert client.get(path, headers=headers).status_code == 200
+
+    counts = {}
+    for path in paths:
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(database.engine, "before_cursor_execute", listener)
+        try:
+            assert client.get(path, headers=headers).status_code == 200
+        finally:
+            event.remove(database.engine, "before_cursor_execute", listener)
+        counts[path.replace(str(project_id), "{id}")] = len(statements)
+    return counts
+
+
+def test_statement_counts_do_not_grow_with_projects_or_students(client):
+    baseline = statement_counts(client, *seed(1))
+    for size in (5, 20):
+        assert statement_counts(client, *seed(size)) == baseline
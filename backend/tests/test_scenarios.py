@@ -0,0 +1,15 @@
+import numpy as np
+from app import algorithm, scenarios
+
+
+def test_capacity_below_the_minimum_closes_the_option():
+    options = [{"id": 1, "capacity": 4, "min_capacity": 0}, {"id": 2, "capacity": 6, "min_capacity": 4}]
+    capacities = scenarios.scenario_capacities(options, {2: 2})
+    assert capacities.tolist() == [4, 0]
+    assert scenarios.scenario_capacities(options, {2: 4}).tolist() == [4, 4]
+
+    # The solver does the same instead of lowering the minimum to the capacity
+    student_idx, option_idx, rank = (np.array(a) for a in ([0, 1, 2, 2, 3, 3], [0, 0, 1, 0, 1, 0], [1, 1, 1, 2, 1, 2]))
+    minimums = np.array([0, 4])
+    assigned = algorithm.solve_assignment_arrays(4, np.array([4, 2]), student_idx, option_idx, rank, "auto", minimums)
+    assert assigned.tolist() == [0, 0, 0, 0]
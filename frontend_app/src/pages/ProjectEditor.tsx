@@ -10,6 +10,7 @@ interface Option {
     requirements: string;
     supervisors: string;
     capacity: string;
+    min_capacity: string;
 }
 
 const ProjectEditor = () => {
@@ -17,7 +18,7 @@ const ProjectEditor = () => {
     const navigate = useNavigate();
     const [title, setTitle] = useState('');
     const [options, setOptions] = useState<Option[]>([
-        { title: '', description: '', requirements: '', supervisors: '', capacity: '50' }
+        { title: '', description: '', requirements: '', supervisors: '', capacity: '50', min_capacity: '' }
     ]);
     const [isFinalised, setIsFinalised] = useState(false);
     const [uniqueCode, setUniqueCode] = useState('');
@@ -40,9 +41,10 @@ const ProjectEditor = () => {
         if (id) {
             api.get(`/api/projects/${id}`).then((res) => {
                 setTitle(res.data.title);
-                setOptions(res.data.options.map((o: { title: string; description: string; requirements: string; supervisors: string; capacity: number }) => ({
+                setOptions(res.data.options.map((o: { title: string; description: string; requirements: string; supervisors: string; capacity: number; min_capacity: number }) => ({
                     ...o,
-                    capacity: String(o.capacity)
+                    capacity: String(o.capacity),
+                    min_capacity: o.min_capacity ? String(o.min_capacity) : ''
                 })));
                 setIsFinalised(res.data.is_active);
                 setUniqueCode(res.data.unique_code);
@@ -58,7 +60,7 @@ const ProjectEditor = () => {
     const handleAddOption = () => {
         setOptions([
             ...options,
-            { title: '', description: '', requirements: '', supervisors: '', capacity: '50' }
+            { title: '', description: '', requirements: '', supervisors: '', capacity: '50', min_capacity: '' }
         ]);
     };
 
@@ -88,7 +90,8 @@ const ProjectEditor = () => {
             title,
             options: validOptions.map(o => ({
                 ...o,
-                capacity: parseInt(o.capacity) || 50
+                capacity: parseInt(o.capacity) || 50,
+                min_capacity: parseInt(o.min_capacity) || 0
             }))
         };
 
@@ -266,26 +269,44 @@ const ProjectEditor = () => {
                                     </div>
                                 </div>
 
-                                <div className="form-group">
-                                    <Label htmlFor={`opt-cap-${i}`}>Max. Capacity</Label>
-                                    <Input
-                                        id={`opt-cap-${i}`}
-                                        type="text"
-                                        inputMode="numeric"
-                                        value={opt.capacity}
-                                        onChange={(e: ChangeEvent<HTMLInputElement>) => {
-                                            const val = e.target.value.replace(/\D/g, '');
-                                            handleOptionChange(i, 'capacity', val);
-                                        }}
-                                        onBlur={() => {
-                                            if (!opt.capacity) {
-                                                handleOptionChange(i, 'capacity', '50');
-                                            }
-                                        }}
-                                        placeholder="50"
-                                        style={{ maxWidth: '10rem' }}
-                                    />
-                                    <p className="form-hint">Maximum students that can be assigned to this option.</p>
+                                <div className="form-row form-row-2 form-group">
+                                    <div>
+                                        <Label htmlFor={`opt-cap-${i}`}>Max. Capacity</Label>
+                                        <Input
+                                            id={`opt-cap-${i}`}
+                                            type="text"
+                                            inputMode="numeric"
+                                            value={opt.capacity}
+                                            onChange={(e: ChangeEvent<HTMLInputElement>) => {
+                                                const val = e.target.value.replace(/\D/g, '');
+                                                handleOptionChange(i, 'capacity', val);
+                                            }}
+                                            onBlur={() => {
+                                                if (!opt.capacity) {
+                                                    handleOptionChange(i, 'capacity', '50');
+                                                }
+                                            }}
+                                            placeholder="50"
+                                            style={{ maxWidth: '10rem' }}
+                                        />
+                                        <p className="form-hint">Maximum students that can be assigned to this option.</p>
+                                    </div>
+                                    <div>
+                                        <Label htmlFor={`opt-min-${i}`} hint="Optional">Min. Capacity</Label>
+                                        <Input
+                                            id={`opt-min-${i}`}
+                                            type="text"
+                                            inputMode="numeric"
+                                            value={opt.min_capacity}
+                                            onChange={(e: ChangeEvent<HTMLInputElement>) => {
+                                                const val = e.target.value.replace(/\D/g, '');
+                                                handleOptionChange(i, 'min_capacity', val);
+                                            }}
+                                            placeholder="0"
+                                            style={{ maxWidth: '10rem' }}
+                                        />
+                                        <p className="form-hint">The option only runs with at least this many students.</p>
+                                    </div>
                                 </div>
                             </div>
                         </Card>